@@ -0,0 +1,17 @@
+"""PDF text extraction run inside the ingestion process pool.
+
+Kept separate from server.py so pool workers only import PyPDF2, not the
+whole app (Chroma, Gemini client, routes).
+"""
+from typing import List
+
+import PyPDF2
+
+
+def count_pages(path: str) -> int:
+    return len(PyPDF2.PdfReader(path).pages)
+
+
+def extract_pages(path: str, start: int, end: int) -> List[str]:
+    reader = PyPDF2.PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
@@ -1,4 +1,5 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Query
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 import os
@@ -7,35 +8,218 @@ import json
 import uuid
 import httpx
 import asyncio
+import gzip
+import threading
+import unicodedata
+import warnings
+import math
+import re
+import hashlib
+import codecs
+import bisect
+import heapq
+import random
+import multiprocessing
+import tempfile
+import sqlite3
+import time
 from pathlib import Path
+from collections import deque, Counter, OrderedDict
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timezone
+from typing import List, Optional, Dict, Any, AsyncIterator, Tuple, Callable, Set
+from datetime import datetime, timezone, timedelta
+import numpy as np
 import chromadb
+from chromadb.utils import embedding_functions
 from google import genai
+import pdf_extract
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-DOCUMENTS_STORE: List[Dict[str, Any]] = []
-MEMORY_FEED: List[Dict[str, Any]] = []
+# Storage: "memory" (lost on restart) or "persistent" (Chroma + document registry under DATA_DIR)
+STORAGE_MODE = os.environ.get('STORAGE_MODE', 'memory').lower()
+DATA_DIR = Path(os.environ.get('DATA_DIR', str(ROOT_DIR / "data")))
 
-# ChromaDB in-memory
-chroma_client = chromadb.Client()
+MEMORY_FEED_SIZE = int(os.environ.get('MEMORY_FEED_SIZE', '500'))
+
+
+class MemoryFeed:
+    """Bounded, append-ordered feed of recent memory entries.
+
+    Entries arrive in time order, so the newest are at the right of the
+    ring buffer and each gets a monotonically increasing ``seq`` cursor.
+    Reads walk back from the newest entry and stop after ``limit`` items.
+    """
+
+    def __init__(self, maxlen: int):
+        self._entries: deque = deque(maxlen=maxlen)
+        self._next_seq = 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def append(self, entry: Dict[str, Any]):
+        self._entries.append({**entry, "seq": self._next_seq})
+        self._next_seq += 1
+
+    def page(self, since: int = 0, before: Optional[int] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Newest-first entries with since < seq < before"""
+        items = reversed(self._entries)
+        if before is not None and self._entries:
+            skip = self._entries[-1]["seq"] - before + 1
+            items = islice(items, max(0, skip), None)
+        page = []
+        for entry in items:
+            if entry["seq"] <= since or len(page) >= limit:
+                break
+            page.append(entry)
+        return page
+
+    def clear(self):
+        self._entries.clear()
+
+
+MEMORY_FEED = MemoryFeed(MEMORY_FEED_SIZE)
+
+
+class DocumentRegistry:
+    """Uploaded document metadata keyed by id, mirrored to SQLite in persistent mode"""
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self._by_hash: Dict[str, Dict[str, Any]] = {}
+        self._conn = None
+        if db_path is not None:
+            self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+            with self._conn:
+                self._conn.execute("CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            rows = self._conn.execute("SELECT data FROM documents ORDER BY rowid").fetchall()
+            for row in rows:
+                doc = json.loads(row[0])
+                self.documents[doc["id"]] = doc
+            self._by_hash = {doc["content_hash"]: doc for doc in self.documents.values() if doc.get("content_hash")}
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def list(self, offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Documents in upload order; only the requested page is copied"""
+        stop = None if limit is None else offset + limit
+        return list(islice(self.documents.values(), offset, stop))
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        return self.documents.get(doc_id)
+
+    def find_by_hash(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        return self._by_hash.get(content_hash)
+
+    def add(self, doc: Dict[str, Any]):
+        self.documents[doc["id"]] = doc
+        if doc.get("content_hash"):
+            self._by_hash[doc["content_hash"]] = doc
+        if self._conn:
+            with self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO documents (id, data) VALUES (?, ?)", (doc["id"], json.dumps(doc)))
+
+    def remove(self, doc_ids: List[str]) -> List[Dict[str, Any]]:
+        """Drop documents by id; returns the ones that existed"""
+        removed = []
+        for doc_id in doc_ids:
+            doc = self.documents.pop(doc_id, None)
+            if doc is None:
+                continue
+            removed.append(doc)
+            if self._by_hash.get(doc.get("content_hash")) is doc:
+                del self._by_hash[doc["content_hash"]]
+        if self._conn and removed:
+            with self._conn:
+                self._conn.executemany("DELETE FROM documents WHERE id = ?", [(doc["id"],) for doc in removed])
+        return removed
+
+    def clear(self):
+        self.documents.clear()
+        self._by_hash.clear()
+        if self._conn:
+            with self._conn:
+                self._conn.execute("DELETE FROM documents")
+
+
+def document_chunk_ids(doc: Dict[str, Any]) -> List[str]:
+    """Chunk ids recorded at ingestion; ids are ``{doc_id}_{i}`` over ``chunk_range``"""
+    start, end = doc.get("chunk_range") or (0, doc["chunks"])
+    return [f"{doc['id']}_{i}" for i in range(start, end)]
+
+
+_storage_started = time.perf_counter()
+if STORAGE_MODE == "persistent":
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    chroma_client = chromadb.PersistentClient(path=str(DATA_DIR / "chroma"))
+    document_registry = DocumentRegistry(DATA_DIR / "documents.db")
+else:
+    chroma_client = chromadb.Client()
+    document_registry = DocumentRegistry()
 collection = chroma_client.get_or_create_collection(
     name="documents",
     metadata={"hnsw:space": "cosine"}
 )
+STORAGE_LOAD_SECONDS = round(time.perf_counter() - _storage_started, 3)
 
-# Memory files
+# Memory files (markdown export view of the memory store)
 USER_MEMORY_PATH = ROOT_DIR / "USER_MEMORY.md"
 COMPANY_MEMORY_PATH = ROOT_DIR / "COMPANY_MEMORY.md"
+MEMORY_DB_PATH = Path(os.environ.get('MEMORY_DB_PATH', str(ROOT_DIR / "memory.db")))
 for p in [USER_MEMORY_PATH, COMPANY_MEMORY_PATH]:
     if not p.exists():
         p.write_text(f"# {'User' if 'USER' in p.name else 'Company'} Memory\n\n")
 
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
 FRONT_END_URL = os.environ.get('FRONT_END_URL','')
+LLM_MODEL = os.environ.get('LLM_MODEL', 'gemini-2.5-flash')
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '4'))
+LLM_RPM = float(os.environ.get('LLM_RPM', '0'))  # 0 disables the limit
+LLM_TPM = float(os.environ.get('LLM_TPM', '0'))
+LLM_RESPONSE_TOKENS = int(os.environ.get('LLM_RESPONSE_TOKENS', '512'))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '3'))
+LLM_BACKOFF_BASE_SECONDS = float(os.environ.get('LLM_BACKOFF_BASE_SECONDS', '2'))
+MEMORY_BATCH_SIZE = int(os.environ.get('MEMORY_BATCH_SIZE', '5'))
+MEMORY_BATCH_WAIT_SECONDS = float(os.environ.get('MEMORY_BATCH_WAIT_SECONDS', '2.0'))
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', str(min(4, os.cpu_count() or 1))))
+INGEST_PAGE_BATCH = int(os.environ.get('INGEST_PAGE_BATCH', '16'))
+INGEST_READ_SIZE = 1024 * 1024
+INGEST_CHUNK_BATCH = 64
+CHUNK_TOKENS = int(os.environ.get('CHUNK_TOKENS', '512'))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get('CHUNK_OVERLAP_TOKENS', '64'))
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', '32'))
+EMBED_MAX_WAIT_MS = float(os.environ.get('EMBED_MAX_WAIT_MS', '5'))
+EMBED_WORKERS = int(os.environ.get('EMBED_WORKERS', '2'))
+RETRIEVAL_TOP_K = int(os.environ.get('RETRIEVAL_TOP_K', '8'))
+RETRIEVAL_CANDIDATES = int(os.environ.get('RETRIEVAL_CANDIDATES', '20'))
+RRF_K = 60
+RETRIEVAL_MAX_DISTANCE = float(os.environ.get('RETRIEVAL_MAX_DISTANCE', '0.8'))
+MMR_LAMBDA = float(os.environ.get('MMR_LAMBDA', '0.7'))
+RETRIEVAL_NEIGHBORS = os.environ.get('RETRIEVAL_NEIGHBORS', 'true').lower() == 'true'
+RETRIEVAL_NEIGHBOR_DISTANCE = float(os.environ.get('RETRIEVAL_NEIGHBOR_DISTANCE', '0.4'))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '2500'))
+ANSWER_CACHE_SIZE = int(os.environ.get('ANSWER_CACHE_SIZE', '256'))
+ANSWER_CACHE_TTL_SECONDS = float(os.environ.get('ANSWER_CACHE_TTL_SECONDS', '3600'))
+ANSWER_CACHE_THRESHOLD = float(os.environ.get('ANSWER_CACHE_THRESHOLD', '0.95'))
+WEATHER_ROLLING_WINDOW_HOURS = int(os.environ.get('WEATHER_ROLLING_WINDOW_HOURS', '6'))
+CHAT_DEADLINE_SECONDS = float(os.environ.get('CHAT_DEADLINE_SECONDS', '30'))
+CHAT_MAX_DEADLINE_SECONDS = float(os.environ.get('CHAT_MAX_DEADLINE_SECONDS', '120'))
+CHAT_ANSWER_RESERVE_SECONDS = float(os.environ.get('CHAT_ANSWER_RESERVE_SECONDS', '8'))
+SESSION_MAX = int(os.environ.get('SESSION_MAX', '1000'))
+SESSION_TTL_SECONDS = float(os.environ.get('SESSION_TTL_SECONDS', '3600'))
+SESSION_HISTORY_TOKENS = int(os.environ.get('SESSION_HISTORY_TOKENS', '800'))
+SESSION_SUMMARY_TOKENS = int(os.environ.get('SESSION_SUMMARY_TOKENS', '200'))
+MEMORY_TOP_K = int(os.environ.get('MEMORY_TOP_K', '5'))
+MEMORY_PROMPT_TOKENS = int(os.environ.get('MEMORY_PROMPT_TOKENS', '200'))
+GAZETTEER_PATH = Path(os.environ.get('GAZETTEER_PATH', str(ROOT_DIR / "resources" / "gazetteer.tsv.gz")))
+OPEN_METEO_URL = os.environ.get('OPEN_METEO_URL', 'https://api.open-meteo.com/v1/forecast')
+WEATHER_TIMEOUT_SECONDS = float(os.environ.get('WEATHER_TIMEOUT_SECONDS', '10'))
 gemini_client = genai.Client(api_key=GEMINI_API_KEY)
 
 app = FastAPI()
@@ -64,6 +248,7 @@ logger = logging.getLogger(__name__)
 class ChatRequest(BaseModel):
     message: str
     session_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    timeout_seconds: Optional[float] = Field(default=None, gt=0)
 
 class Citation(BaseModel):
     source: str
@@ -73,6 +258,9 @@ class Citation(BaseModel):
 class ThoughtStep(BaseModel):
     step: str
     detail: str
+    started_ms: Optional[float] = None  # milliseconds since the request started
+    ended_ms: Optional[float] = None
+    duration_ms: Optional[float] = None
 
 class MemoryEntry(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -87,130 +275,1219 @@ class ChatResponse(BaseModel):
     memory_updates: List[MemoryEntry] = []
 
 
+# --- Metrics ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per label set"""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            # per-bucket counts, then sum and count
+            series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', repr(bound)),))} {cumulative:g}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series[-1]:g}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]:g}")
+        return lines
+
+
+class CallbackMetric:
+    """Counter or gauge read from existing state when /metrics is scraped"""
+
+    def __init__(self, name: str, help_text: str, kind: str, read: Callable[[], Dict[Tuple[Tuple[str, str], ...], float]]):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.read = read
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.read().items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def histogram(self, name: str, help_text: str) -> Histogram:
+        metric = Histogram(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def callback(self, name: str, help_text: str, kind: str, read: Callable[[], Dict[Tuple[Tuple[str, str], ...], float]]):
+        self._metrics.append(CallbackMetric(name, help_text, kind, read))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.warning(f"Metric {metric.name} failed to render: {e}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+INGEST_STAGE_SECONDS = metrics.histogram("rag_ingest_stage_seconds", "Time per upload spent in each ingestion stage (parse, chunk, embed, index).")
+CHAT_STAGE_SECONDS = metrics.histogram("rag_chat_stage_seconds", "Time spent in each chat pipeline stage.")
+CHAT_REQUEST_SECONDS = metrics.histogram("rag_chat_request_seconds", "End-to-end chat request latency.")
+LLM_REQUEST_SECONDS = metrics.histogram("rag_llm_request_seconds", "Gemini call latency including queueing, backoff and retries.")
+MEMORY_EXTRACTION_SECONDS = metrics.histogram("rag_memory_extraction_seconds", "Time to extract and store memory for one batch of exchanges.")
+
+
+# --- LLM gateway ---
+LLM_PRIORITY_INTERACTIVE = 0
+LLM_PRIORITY_BACKGROUND = 1
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return getattr(error, "code", None) == 429 or "429" in str(error) or "RESOURCE_EXHAUSTED" in str(error)
+
+
+class LLMGateway:
+    """Process-wide scheduler for all Gemini traffic.
+
+    Requests wait in a priority queue (interactive chat ahead of background
+    memory and summary work) and are admitted while there is a free
+    concurrency slot and room in the requests- and tokens-per-minute
+    buckets (a limit of 0 disables that bucket). A 429 from Gemini pauses
+    admission for every caller with a shared exponential backoff plus
+    jitter, and the request is retried at its original queue position.
+    Streams are only retried before their first chunk.
+    """
+
+    def __init__(
+        self,
+        client: genai.Client,
+        model: str,
+        max_concurrency: int,
+        rpm: float = 0,
+        tpm: float = 0,
+        max_retries: int = 3,
+        backoff_base: float = 2.0,
+        backoff_max: float = 60.0
+    ):
+        self.client = client
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._queue: List[Tuple[int, int, int, asyncio.Future]] = []
+        self._seq = 0
+        self._in_flight = 0
+        self._request_budget = float(rpm)
+        self._token_budget = float(tpm)
+        self._refilled: Optional[float] = None
+        self._blocked_until = 0.0
+        self._consecutive_limits = 0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self.requests = 0
+        self.rate_limited = 0
+
+    async def generate(self, prompt: str, priority: int = LLM_PRIORITY_INTERACTIVE) -> str:
+        tokens = estimate_tokens(prompt) + LLM_RESPONSE_TOKENS
+        started = time.perf_counter()
+        seq = None
+        try:
+            for attempt in range(self.max_retries + 1):
+                seq = await self._acquire(priority, tokens, seq)
+                try:
+                    result = await self.client.aio.models.generate_content(
+                        model=self.model,
+                        contents=prompt
+                    )
+                    self._consecutive_limits = 0
+                    return result.text or ""
+                except Exception as e:
+                    if not is_rate_limited(e) or attempt == self.max_retries:
+                        raise
+                    self._back_off()
+                finally:
+                    self._release()
+        finally:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, kind="generate")
+
+    async def stream(self, prompt: str, priority: int = LLM_PRIORITY_INTERACTIVE) -> AsyncIterator[str]:
+        tokens = estimate_tokens(prompt) + LLM_RESPONSE_TOKENS
+        began = time.perf_counter()
+        seq = None
+        try:
+            for attempt in range(self.max_retries + 1):
+                seq = await self._acquire(priority, tokens, seq)
+                started = False
+                try:
+                    stream = await self.client.aio.models.generate_content_stream(
+                        model=self.model,
+                        contents=prompt
+                    )
+                    async for chunk in stream:
+                        if chunk.text:
+                            started = True
+                            self._consecutive_limits = 0
+                            yield chunk.text
+                    self._consecutive_limits = 0
+                    return
+                except Exception as e:
+                    if started or not is_rate_limited(e) or attempt == self.max_retries:
+                        raise
+                    self._back_off()
+                finally:
+                    self._release()
+        finally:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - began, kind="stream")
+
+    def stats(self) -> Dict[str, Any]:
+        queued = Counter("interactive" if p == LLM_PRIORITY_INTERACTIVE else "background" for p, _, _, fut in self._queue if not fut.done())
+        return {
+            "queued_interactive": queued["interactive"],
+            "queued_background": queued["background"],
+            "in_flight": self._in_flight,
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "backoff_seconds": round(max(0.0, self._blocked_until - time.monotonic()), 2)
+        }
+
+    async def _acquire(self, priority: int, tokens: int, seq: Optional[int] = None) -> int:
+        """Wait for admission; a retry passes its original seq to keep its place in line"""
+        if seq is None:
+            seq = self._seq
+            self._seq += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, seq, min(tokens, int(self.tpm)) if self.tpm > 0 else tokens, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        return seq
+
+    def _release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    def _back_off(self):
+        self.rate_limited += 1
+        self._consecutive_limits += 1
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (self._consecutive_limits - 1))
+        delay *= random.uniform(0.5, 1.5)
+        now = time.monotonic()
+        self._blocked_until = max(self._blocked_until, now + delay)
+        logger.info(f"LLM rate limited, pausing all requests for {self._blocked_until - now:.1f}s")
+
+    def _refill(self, now: float):
+        if self._refilled is not None:
+            elapsed = now - self._refilled
+            self._request_budget = min(self.rpm, self._request_budget + elapsed * self.rpm / 60)
+            self._token_budget = min(self.tpm, self._token_budget + elapsed * self.tpm / 60)
+        self._refilled = now
+
+    def _dispatch(self):
+        now = time.monotonic()
+        self._refill(now)
+        while self._queue and self._in_flight < self.max_concurrency:
+            priority, seq, tokens, future = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            wait = self._blocked_until - now
+            if wait <= 0:
+                wait = max(
+                    (1 - self._request_budget) * 60 / self.rpm if self.rpm > 0 else 0.0,
+                    (tokens - self._token_budget) * 60 / self.tpm if self.tpm > 0 else 0.0
+                )
+            if wait > 0:
+                self._schedule(wait)
+                return
+            heapq.heappop(self._queue)
+            self._request_budget -= 1
+            self._token_budget -= tokens
+            self._in_flight += 1
+            self.requests += 1
+            future.set_result(None)
+
+    def _schedule(self, delay: float):
+        loop = asyncio.get_running_loop()
+        when = loop.time() + delay
+        if self._wakeup is not None and not self._wakeup.cancelled() and self._wakeup.when() <= when:
+            return
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._wakeup = loop.call_at(when, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+
+llm_gateway = LLMGateway(
+    gemini_client,
+    LLM_MODEL,
+    LLM_MAX_CONCURRENCY,
+    rpm=LLM_RPM,
+    tpm=LLM_TPM,
+    max_retries=LLM_MAX_RETRIES,
+    backoff_base=LLM_BACKOFF_BASE_SECONDS
+)
+metrics.callback("rag_llm_requests_total", "Gemini calls admitted by the scheduler, retries included.", "counter",
+                 lambda: {(): llm_gateway.requests})
+metrics.callback("rag_llm_rate_limited_total", "Gemini 429 responses.", "counter",
+                 lambda: {(): llm_gateway.rate_limited})
+metrics.callback("rag_llm_queue_depth", "Gemini calls waiting for admission.", "gauge",
+                 lambda: {(("priority", "interactive"),): llm_gateway.stats()["queued_interactive"],
+                          (("priority", "background"),): llm_gateway.stats()["queued_background"]})
+metrics.callback("rag_llm_in_flight", "Gemini calls currently running.", "gauge",
+                 lambda: {(): llm_gateway.stats()["in_flight"]})
+
+
+# --- Embedding service ---
+EMBED_PRIORITY_QUERY = 0
+EMBED_PRIORITY_INGEST = 1
+
+_default_embedding_function = None
+
+
+def default_embed(texts: List[str]) -> List[List[float]]:
+    """Chroma's default (ONNX MiniLM) embedding, loaded on first use"""
+    global _default_embedding_function
+    if _default_embedding_function is None:
+        _default_embedding_function = embedding_functions.DefaultEmbeddingFunction()
+    return [[float(x) for x in vector] for vector in _default_embedding_function(texts)]
+
+
+class EmbeddingService:
+    """Computes embeddings off the event loop, merging concurrent requests into micro-batches.
+
+    Query and ingestion requests share one priority queue (queries first). The
+    dispatcher waits up to EMBED_MAX_WAIT_MS to fill a batch of EMBED_BATCH_SIZE
+    texts, and only forms a batch when a worker is free, so queued queries
+    overtake ingestion chunks that have not started yet.
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], List[List[float]]], batch_size: int, max_wait_ms: float, workers: int):
+        self.embed_fn = embed_fn
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed")
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+        self._seq = 0
+
+    def start(self):
+        self._queue = asyncio.PriorityQueue()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._queue = None
+
+    async def embed(self, texts: List[str], priority: int = EMBED_PRIORITY_QUERY) -> List[List[float]]:
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        if self._queue is None:
+            return await loop.run_in_executor(self._executor, self.embed_fn, texts)
+        futures = []
+        for start in range(0, len(texts), self.batch_size):
+            fut = loop.create_future()
+            self._seq += 1
+            self._queue.put_nowait((priority, self._seq, texts[start:start + self.batch_size], fut))
+            futures.append(fut)
+        vectors = []
+        for part in await asyncio.gather(*futures):
+            vectors.extend(part)
+        return vectors
+
+    async def _next_batch(self) -> List[Tuple[List[str], asyncio.Future]]:
+        _, _, texts, fut = await self._queue.get()
+        batch = [(texts, fut)]
+        size = len(texts)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while size < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                _, _, texts, fut = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            batch.append((texts, fut))
+            size += len(texts)
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                batch = await self._next_batch()
+            except BaseException:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._compute(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _compute(self, batch: List[Tuple[List[str], asyncio.Future]]):
+        try:
+            texts = [text for part, _ in batch for text in part]
+            loop = asyncio.get_running_loop()
+            vectors = await loop.run_in_executor(self._executor, self.embed_fn, texts)
+            offset = 0
+            for part, fut in batch:
+                if not fut.done():
+                    fut.set_result(vectors[offset:offset + len(part)])
+                offset += len(part)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+        finally:
+            self._slots.release()
+
+
+embedding_service = EmbeddingService(default_embed, EMBED_BATCH_SIZE, EMBED_MAX_WAIT_MS, EMBED_WORKERS)
+
+
 # --- Utilities ---
-def parse_file(content: bytes, filename: str) -> str:
-    ext = filename.lower().rsplit('.', 1)[-1]
-    if ext == 'pdf':
-        import PyPDF2
-        import io
-        reader = PyPDF2.PdfReader(io.BytesIO(content))
-        return "\n".join(page.extract_text() or "" for page in reader.pages)
-    elif ext in ('md', 'txt'):
-        return content.decode('utf-8', errors='ignore')
-    return ""
-
-
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk = " ".join(words[i:i + chunk_size])
-        if chunk.strip():
-            chunks.append(chunk)
-    if not chunks and text.strip():
-        chunks.append(text.strip())
-    return chunks
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for prompt budgets"""
+    return max(1, (len(text) + 3) // 4)
+
+
+SENTENCE_BOUNDARY_RE = re.compile(r"[.!?][\"')\]]*(?P<sep>\s+)|(?P<para>\n[ \t]*\n\s*)")
+
+
+class SentenceChunker:
+    """Sentence- and paragraph-aware chunker sized by estimated tokens, fed incrementally.
+
+    Text is scanned once for sentence and paragraph boundaries; chunks are
+    slices of the buffered text, so words are never split and re-joined.
+    Chunks close before exceeding ``max_tokens`` (earlier at a paragraph
+    end once they are 3/4 full) and the next chunk repeats up to
+    ``overlap_tokens`` of trailing sentences. Sentences longer than a chunk
+    are cut at whitespace. Each chunk records its character offsets in the
+    whole extracted text and, for paged input, the pages it spans.
+    """
+
+    def __init__(self, max_tokens: int = 512, overlap_tokens: int = 64):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self._max_chars = max_tokens * 4
+        self._buffer = ""
+        self._base = 0          # text offset of _buffer[0]
+        self._scan = 0          # text offset where the next sentence starts
+        self._units: deque = deque()  # (start, end, tokens) of sentences in the open chunk
+        self._tokens = 0
+        self._emitted_end = 0
+        self._page_offsets: List[int] = []
+        self._page_numbers: List[int] = []
+        self._chunks: List[Dict[str, Any]] = []
+
+    def feed(self, text: str, page: Optional[int] = None) -> List[Dict[str, Any]]:
+        end = self._base + len(self._buffer)
+        if page is not None and (not self._page_numbers or self._page_numbers[-1] != page):
+            self._page_offsets.append(end)
+            self._page_numbers.append(page)
+        self._buffer += text
+        for match in SENTENCE_BOUNDARY_RE.finditer(self._buffer, self._scan - self._base):
+            if match.group('para') is not None:
+                content_end, paragraph = match.start('para'), True
+            else:
+                content_end, paragraph = match.start('sep'), match.group('sep').count("\n") >= 2
+            self._add_span(self._scan, self._base + content_end, paragraph)
+            self._scan = self._base + match.end()
+        # No boundary in sight: cut the pending text at whitespace rather than buffer it all
+        end = self._base + len(self._buffer)
+        if end - self._scan > 2 * self._max_chars:
+            cut = self._buffer.rfind(" ", 0, end - self._base - self._max_chars)
+            if cut > self._scan - self._base:
+                self._add_span(self._scan, self._base + cut, False)
+                self._scan = self._base + cut + 1
+        keep_from = min(self._units[0][0], self._scan) if self._units else self._scan
+        self._buffer = self._buffer[keep_from - self._base:]
+        self._base = keep_from
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+    def finish(self) -> List[Dict[str, Any]]:
+        self.feed("")
+        self._add_span(self._scan, self._base + len(self._buffer), True)
+        if self._units and self._units[-1][1] > self._emitted_end:
+            self._emit()
+        chunks = self._chunks
+        self.__init__(self.max_tokens, self.overlap_tokens)
+        return chunks
+
+    def _text(self, start: int, end: int) -> str:
+        return self._buffer[start - self._base:end - self._base]
+
+    def _add_span(self, start: int, end: int, paragraph: bool):
+        while start < end and self._buffer[start - self._base].isspace():
+            start += 1
+        while end > start and self._buffer[end - self._base - 1].isspace():
+            end -= 1
+        while end - start > self._max_chars:
+            cut = self._buffer.rfind(" ", start - self._base, start - self._base + self._max_chars) + self._base
+            if cut <= start:
+                cut = start + self._max_chars
+            self._add_unit(start, cut, False)
+            start = cut
+            while start < end and self._buffer[start - self._base].isspace():
+                start += 1
+        if end > start:
+            self._add_unit(start, end, paragraph)
+
+    def _add_unit(self, start: int, end: int, paragraph: bool):
+        tokens = estimate_tokens(self._text(start, end))
+        if self._units and self._tokens + tokens > self.max_tokens:
+            if self._units[-1][1] > self._emitted_end:
+                self._emit()
+            else:
+                # Only carried-over overlap is open; it would not fit beside this sentence
+                self._units.clear()
+                self._tokens = 0
+        self._units.append((start, end, tokens))
+        self._tokens += tokens
+        if paragraph and self._tokens >= self.max_tokens * 3 // 4:
+            self._emit()
+
+    def _page_at(self, offset: int) -> Optional[int]:
+        index = bisect.bisect_right(self._page_offsets, offset) - 1
+        return self._page_numbers[index] if index >= 0 else None
+
+    def _emit(self):
+        start, end = self._units[0][0], self._units[-1][1]
+        chunk = {"text": self._text(start, end), "char_start": start, "char_end": end}
+        if self._page_numbers:
+            chunk["page_start"] = self._page_at(start)
+            chunk["page_end"] = self._page_at(end - 1)
+        self._chunks.append(chunk)
+        self._emitted_end = end
+        # Carry trailing sentences into the next chunk as overlap
+        kept = 0
+        overlap = deque()
+        while len(self._units) > 1 and kept + self._units[-1][2] <= self.overlap_tokens:
+            unit = self._units.pop()
+            overlap.appendleft(unit)
+            kept += unit[2]
+        self._units = overlap
+        self._tokens = kept
+
+
+_ingest_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_ingest_pool() -> ProcessPoolExecutor:
+    global _ingest_pool
+    if _ingest_pool is None:
+        _ingest_pool = ProcessPoolExecutor(
+            max_workers=INGEST_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _ingest_pool
 
 
-async def fetch_weather_data(query: str) -> Optional[Dict]:
-    cities = {
-        "london": (51.5074, -0.1278, "London"),
-        "paris": (48.8566, 2.3522, "Paris"),
-        "tokyo": (35.6762, 139.6503, "Tokyo"),
-        "new york": (40.7128, -74.0060, "New York"),
-        "san francisco": (37.7749, -122.4194, "San Francisco"),
-        "berlin": (52.5200, 13.4050, "Berlin"),
-        "sydney": (-33.8688, 151.2093, "Sydney"),
-        "mumbai": (19.0760, 72.8777, "Mumbai"),
-        "dubai": (25.2048, 55.2708, "Dubai"),
-        "singapore": (1.3521, 103.8198, "Singapore"),
-        "los angeles": (34.0522, -118.2437, "Los Angeles"),
-        "chicago": (41.8781, -87.6298, "Chicago"),
-    }
-    lat, lon, location_name = 40.7128, -74.0060, "New York"
-    for city, (c_lat, c_lon, c_name) in cities.items():
-        if city in query.lower():
-            lat, lon, location_name = c_lat, c_lon, c_name
-            break
+def discard_ingest_pool(pool: ProcessPoolExecutor):
+    """Drop a broken pool (e.g. a worker was OOM-killed) so the next upload starts a fresh one"""
+    global _ingest_pool
+    if _ingest_pool is pool:
+        _ingest_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        logger.warning("Ingest process pool broke; it will be recreated on the next upload")
+
+
+async def iter_pdf_pages(path: str) -> AsyncIterator[str]:
+    """Extract PDF pages in the process pool, yielding them in order with a bounded number of batches in flight"""
+    loop = asyncio.get_running_loop()
+    pool = get_ingest_pool()
+    try:
+        page_count = await loop.run_in_executor(pool, pdf_extract.count_pages, path)
+    except BrokenProcessPool:
+        discard_ingest_pool(pool)
+        raise
+    batches = iter(range(0, page_count, INGEST_PAGE_BATCH))
+    in_flight = deque()
+
+    def submit_next():
+        start = next(batches, None)
+        if start is not None:
+            end = min(start + INGEST_PAGE_BATCH, page_count)
+            in_flight.append(loop.run_in_executor(pool, pdf_extract.extract_pages, path, start, end))
+
+    for _ in range(INGEST_WORKERS * 2):
+        submit_next()
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(
-                "https://api.open-meteo.com/v1/forecast",
-                params={
-                    "latitude": lat, "longitude": lon,
-                    "hourly": "temperature_2m,relative_humidity_2m,wind_speed_10m,precipitation",
-                    "forecast_days": 3, "timezone": "auto"
-                },
-                timeout=10
+        while in_flight:
+            pages = await in_flight.popleft()
+            submit_next()
+            for page in pages:
+                yield page + "\n"
+    except BrokenProcessPool:
+        discard_ingest_pool(pool)
+        raise
+    finally:
+        for fut in in_flight:
+            fut.cancel()
+
+
+async def iter_upload_text(file: UploadFile, ext: str) -> AsyncIterator[Tuple[str, Optional[int]]]:
+    """Yield the upload's text in pieces with their 1-based page number (None for MD/TXT).
+
+    PDFs are spooled to disk and extracted page by page.
+    """
+    if ext == 'pdf':
+        tmp = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+        try:
+            with tmp:
+                while piece := await file.read(INGEST_READ_SIZE):
+                    tmp.write(piece)
+            page_number = 0
+            async for page in iter_pdf_pages(tmp.name):
+                page_number += 1
+                yield page, page_number
+        finally:
+            os.unlink(tmp.name)
+    else:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        while piece := await file.read(INGEST_READ_SIZE):
+            yield decoder.decode(piece), None
+        yield decoder.decode(b"", final=True), None
+
+
+class WeatherClient:
+    """Shared Open-Meteo client with pooled connections, a per-location cache and single-flight fetches.
+
+    Cached forecasts expire at the next top of the hour, matching the
+    forecast's hourly resolution. Concurrent requests for the same location
+    share one upstream call, which runs as its own task so that a caller
+    giving up (e.g. its deadline passed) does not cancel it for the others.
+    """
+
+    def __init__(self, base_url: str, timeout: float, max_entries: int = 1024):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.upstream_calls = 0
+        self.cache_hits = 0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._cache: "OrderedDict[Tuple[float, float], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[float, float], asyncio.Task] = {}
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
             )
-            data = resp.json()
 
-        temps = data.get("hourly", {}).get("temperature_2m", [])[:24]
-        humidity = data.get("hourly", {}).get("relative_humidity_2m", [])[:24]
-        wind = data.get("hourly", {}).get("wind_speed_10m", [])[:24]
+    async def stop(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def clear(self):
+        self._cache.clear()
+
+    async def forecast(self, lat: float, lon: float) -> Dict[str, Any]:
+        key = (round(lat, 4), round(lon, 4))
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.time():
+            self.cache_hits += 1
+            self._cache.move_to_end(key)
+            return cached[1]
+        task = self._inflight.get(key)
+        if task is None:
+            # Detached from the caller, so one request's deadline cannot cancel a fetch others are waiting on
+            task = asyncio.create_task(self._fetch_and_cache(key, lat, lon))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())  # retrieve errors even if every caller gave up
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _fetch_and_cache(self, key: Tuple[float, float], lat: float, lon: float) -> Dict[str, Any]:
+        try:
+            data = await self._fetch(lat, lon)
+        finally:
+            del self._inflight[key]
+        expires = (int(time.time() // 3600) + 1) * 3600
+        self._cache[key] = (expires, data)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return data
+
+    async def _fetch(self, lat: float, lon: float) -> Dict[str, Any]:
+        await self.start()
+        self.upstream_calls += 1
+        resp = await self._client.get(
+            self.base_url,
+            params={
+                "latitude": lat, "longitude": lon,
+                "hourly": "temperature_2m,relative_humidity_2m,wind_speed_10m,precipitation",
+                "forecast_days": 3, "timezone": "auto"
+            }
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+
+weather_client = WeatherClient(OPEN_METEO_URL, WEATHER_TIMEOUT_SECONDS)
+
+# Output name -> Open-Meteo hourly variable
+WEATHER_SERIES = {
+    "temperature": "temperature_2m",
+    "humidity": "relative_humidity_2m",
+    "wind_speed": "wind_speed_10m",
+    "precipitation": "precipitation",
+}
+
+
+def _rounded(values: np.ndarray, digits: int = 1) -> Any:
+    """Round a scalar or array for JSON, mapping NaN to None"""
+    if np.ndim(values) == 0:
+        return None if np.isnan(values) else round(float(values), digits) + 0.0
+    return [None if np.isnan(v) else round(float(v), digits) + 0.0 for v in values]
+
+
+def current_hour_index(times: List[str], utc_offset_seconds: int = 0, now: Optional[datetime] = None) -> int:
+    """Index of the current local hour in Open-Meteo's hourly times, which start at 00:00 today; 0 if it is not in range"""
+    if not times:
+        return 0
+    now = (now or datetime.now(timezone.utc)) + timedelta(seconds=utc_offset_seconds)
+    current = now.strftime("%Y-%m-%dT%H:00")
+    if not times[0] <= current <= times[-1]:
+        return 0
+    return bisect.bisect_left(times, current)
+
+
+def analyze_forecast(
+    location_name: str,
+    hourly: Dict[str, List[Any]],
+    window: int = WEATHER_ROLLING_WINDOW_HOURS,
+    utc_offset_seconds: int = 0,
+    now: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """Compact analytics over every returned hour of every series, computed in one vectorized pass.
+
+    All series are stacked into one (series x hours) matrix so means,
+    volatility, trend, rolling means and per-day aggregates are single numpy
+    reductions; missing values are NaN and ignored. The series starts at
+    00:00 local time today, so the 24h figures start from the current hour.
+    """
+    names = list(WEATHER_SERIES)
+    raw = [hourly.get(WEATHER_SERIES[name]) or [] for name in names]
+    hours = max((len(values) for values in raw), default=0)
+    matrix = np.full((len(names), hours), np.nan)
+    for row, values in enumerate(raw):
+        matrix[row, :len(values)] = [np.nan if v is None else v for v in values]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(matrix, axis=1)
+        volatility = np.nanstd(matrix, axis=1)
+        start = current_hour_index(hourly.get("time") or [], utc_offset_seconds, now)
+        next_24h = matrix[:, start:start + 24]
+        mean_24h = np.nanmean(next_24h, axis=1)
+        min_24h = np.nanmin(next_24h, axis=1) if next_24h.shape[1] else np.full(len(names), np.nan)
+        max_24h = np.nanmax(next_24h, axis=1) if next_24h.shape[1] else np.full(len(names), np.nan)
+
+        # Least-squares slope per hour
+        x = np.arange(hours) - (hours - 1) / 2
+        centered = np.where(np.isnan(matrix), 0.0, matrix - mean[:, None])
+        weights = np.where(np.isnan(matrix), 0.0, x)
+        denom = np.sum(weights * x, axis=1)
+        trend = np.divide(np.sum(centered * weights, axis=1), denom, out=np.full(len(names), np.nan), where=denom > 0)
+
+        if hours >= window:
+            rolling = np.nanmean(np.lib.stride_tricks.sliding_window_view(matrix, window, axis=1), axis=2)[:, ::window]
+        else:
+            rolling = np.empty((len(names), 0))
+
+        days = hours // 24
+        by_day = matrix[:, :days * 24].reshape(len(names), days, 24)
+        day_min = np.nanmin(by_day, axis=2) if days else by_day[:, :, 0]
+        day_max = np.nanmax(by_day, axis=2) if days else by_day[:, :, 0]
+        day_mean = np.nanmean(by_day, axis=2)
+        day_total = np.nansum(by_day, axis=2)
+
+    t, h, w, p = (names.index(n) for n in ("temperature", "humidity", "wind_speed", "precipitation"))
+    times = hourly.get("time") or []
+    daily = []
+    for d in range(days):
+        daily.append({
+            "date": times[d * 24][:10] if len(times) > d * 24 else f"day {d + 1}",
+            "temp_min": _rounded(day_min[t, d]),
+            "temp_max": _rounded(day_max[t, d]),
+            "temp_mean": _rounded(day_mean[t, d]),
+            "humidity_mean": _rounded(day_mean[h, d]),
+            "wind_max": _rounded(day_max[w, d]),
+            "precipitation_total": _rounded(day_total[p, d]),
+        })
+
+    if hours:
+        summary = (
+            f"{location_name}: Avg {mean_24h[t]:.1f} C, Range {min_24h[t]:.1f}-{max_24h[t]:.1f} C "
+            f"(next 24h); {hours}h trend {trend[t]:+.2f} C/h"
+        )
+    else:
+        summary = f"{location_name}: no hourly forecast data"
 
-        avg_temp = sum(temps) / len(temps) if temps else 0
-        max_temp = max(temps) if temps else 0
-        min_temp = min(temps) if temps else 0
-        avg_humidity = sum(humidity) / len(humidity) if humidity else 0
-        avg_wind = sum(wind) / len(wind) if wind else 0
+    return {
+        "summary": summary,
+        "hours_analyzed": hours,
+        "next_24h_from": times[start] if start < len(times) else None,
+        "avg_temperature_24h": _rounded(mean_24h[t]),
+        "max_temperature": _rounded(max_24h[t]),
+        "min_temperature": _rounded(min_24h[t]),
+        "temperature_volatility": _rounded(volatility[t], 2),
+        "avg_humidity": _rounded(mean_24h[h]),
+        "avg_wind_speed": _rounded(mean_24h[w]),
+        "precipitation_total": _rounded(np.nansum(matrix[p]) if hours else np.nan),
+        "series": {
+            name: {
+                "mean": _rounded(mean[i]),
+                "volatility": _rounded(volatility[i], 2),
+                "trend_per_hour": _rounded(trend[i], 3),
+                f"rolling_mean_{window}h": _rounded(rolling[i], 2),
+            }
+            for i, name in enumerate(names)
+        },
+        "daily": daily,
+        "unit": "celsius"
+    }
 
-        volatility = 0
-        if len(temps) > 1:
-            mean = avg_temp
-            variance = sum((t - mean) ** 2 for t in temps) / len(temps)
-            volatility = variance ** 0.5
 
-        return {
-            "location": location_name,
-            "summary": f"{location_name}: Avg {avg_temp:.1f} C, Range {min_temp:.1f}-{max_temp:.1f} C",
-            "avg_temperature_24h": round(avg_temp, 1),
-            "max_temperature": round(max_temp, 1),
-            "min_temperature": round(min_temp, 1),
-            "temperature_volatility": round(volatility, 2),
-            "avg_humidity": round(avg_humidity, 1),
-            "avg_wind_speed": round(avg_wind, 1),
-            "hourly_temps": temps,
-            "unit": "celsius"
-        }
+# --- Location resolution ---
+LOCATION_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+LOCATION_PREPOSITIONS = {"in", "at", "for", "near", "around", "of", "to", "from"}
+# Lowercase, unprompted names are only trusted for cities this large
+LOCATION_MIN_POPULATION_UNMARKED = 1_000_000
+
+
+def fold_ascii(text: str) -> str:
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode()
+
+
+class Gazetteer:
+    """Place names compiled into a word-level Aho-Corasick automaton.
+
+    find() scans the query once, whatever the gazetteer size. A lowercase
+    match that does not follow a location preposition ("in", "for", ...)
+    only counts for very large cities, so "reading" in "I'm reading" is not
+    taken for Reading, UK. The longest match wins, then the larger city.
+    """
+
+    def __init__(self):
+        self.places: List[Tuple[str, float, float, str, int]] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, int]]] = [[]]
+        self._keys: Dict[Tuple[str, ...], int] = {}
+
+    def __len__(self) -> int:
+        return len(self.places)
+
+    @classmethod
+    def load(cls, path: Path) -> "Gazetteer":
+        gazetteer = cls()
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            next(f)  # header
+            for line in f:
+                name, lat, lon, country, population, alternates = line.rstrip("\n").split("\t")
+                place = (name, float(lat), float(lon), country, int(population))
+                for alias in [name] + [a for a in alternates.split("|") if a]:
+                    gazetteer.add(alias, place)
+        gazetteer.build()
+        return gazetteer
+
+    def add(self, name: str, place: Tuple[str, float, float, str, int]):
+        words = tuple(w.lower() for w in LOCATION_WORD_RE.findall(fold_ascii(name)))
+        if not words:
+            return
+        existing = self._keys.get(words)
+        if existing is not None:
+            if self.places[existing][4] < place[4]:
+                self.places[existing] = place
+            return
+        self.places.append(place)
+        self._keys[words] = len(self.places) - 1
+        node = 0
+        for word in words:
+            nxt = self._goto[node].get(word)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][word] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(self.places) - 1, len(words)))
+
+    def build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for word, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(word, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child].extend(self._out[self._fail[child]])
+
+    def find(self, query: str) -> Optional[Dict[str, Any]]:
+        matches = list(LOCATION_WORD_RE.finditer(fold_ascii(query)))
+        words = [m.group().lower() for m in matches]
+        best = None
+        node = 0
+        for end, word in enumerate(words):
+            while node and word not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(word, 0)
+            for place_idx, length in self._out[node]:
+                start = end - length + 1
+                place = self.places[place_idx]
+                marked = matches[start].group()[0].isupper() or (start > 0 and words[start - 1] in LOCATION_PREPOSITIONS)
+                if not marked and place[4] < LOCATION_MIN_POPULATION_UNMARKED:
+                    continue
+                rank = (length, place[4])
+                if best is None or rank > best[0]:
+                    best = (rank, place)
+        if best is None:
+            return None
+        name, lat, lon, country, population = best[1]
+        return {"name": name, "latitude": lat, "longitude": lon, "country": country, "population": population}
+
+
+_gazetteer: Optional[Gazetteer] = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    global _gazetteer
+    with _gazetteer_lock:
+        if _gazetteer is None:
+            started = time.perf_counter()
+            try:
+                _gazetteer = Gazetteer.load(GAZETTEER_PATH)
+                logger.info(f"Loaded {len(_gazetteer)} places from {GAZETTEER_PATH.name} in {time.perf_counter() - started:.2f}s")
+            except OSError as e:
+                logger.error(f"Gazetteer load error: {e}")
+                _gazetteer = Gazetteer()
+        return _gazetteer
+
+
+# --- Intent routing ---
+WEATHER_STRONG_RE = re.compile(
+    r"\b(weather|forecasts?|temperatures?|humidity|humid|precipitation|rain(?:s|ing|y|fall)?|snow(?:s|ing|y)?|"
+    r"wind(?:s|y)?|sunny|cloudy|storms?|stormy|thunder\w*|drizzle|degrees|celsius|fahrenheit|umbrella)\b",
+    re.IGNORECASE
+)
+WEATHER_WEAK_RE = re.compile(r"\b(hot|cold|warm|chilly|freezing|climate|outside|jacket)\b", re.IGNORECASE)
+DOCUMENT_RE = re.compile(
+    r"\b(docs?|documents?|files?|pdfs?|uploaded|upload|according|policy|policies|section|page|manual|"
+    r"spec(?:ification)?s?|guides?|handbook|readme|architecture|api|endpoint|error|config\w*|setup|install\w*)\b",
+    re.IGNORECASE
+)
+SMALL_TALK_RE = re.compile(
+    r"^\s*(hi|hello|hey|yo|thanks|thank you|thx|ok|okay|cool|great|bye|goodbye|good (morning|afternoon|evening|night))"
+    r"\b[\s!.,?]*(there|again|so much|a lot)?[\s!.,?]*$",
+    re.IGNORECASE
+)
+MEMORY_RE = re.compile(
+    r"\b(i|i'm|im|i've|my|mine|we|we're|our|prefer\w*|always|usually|remember|team|company|project|role)\b",
+    re.IGNORECASE
+)
+
+
+class RouteDecision(BaseModel):
+    weather: bool
+    documents: bool
+    memory: bool
+    reason: str
+
+    def describe(self) -> str:
+        flags = ", ".join(f"{name}: {'on' if on else 'off'}" for name, on in (
+            ("weather tool", self.weather), ("document retrieval", self.documents), ("memory", self.memory)
+        ))
+        return f"{flags} ({self.reason})"
+
+
+def route_query(message: str, corpus_size: int) -> RouteDecision:
+    """Decide which pipeline stages a query needs, using compiled patterns and a small additive score.
+
+    Strong weather terms score 2, weak ones ("hot", "cold") 1, and a resolvable
+    place name 1; the weather tool runs at 2 or more, so "cold start bug"
+    does not trigger it but "is it cold in Oslo" does.
+    """
+    if SMALL_TALK_RE.match(message):
+        return RouteDecision(weather=False, documents=False, memory=False, reason="small talk")
+
+    weather_score = 2 * bool(WEATHER_STRONG_RE.search(message)) + bool(WEATHER_WEAK_RE.search(message))
+    if weather_score == 1:
+        weather_score += get_gazetteer().find(message) is not None
+    weather = weather_score >= 2
+    doc_cue = bool(DOCUMENT_RE.search(message)) or bool(exact_lookup_terms(message))
+    memory = bool(MEMORY_RE.search(message))
+
+    if corpus_size == 0:
+        return RouteDecision(weather=weather, documents=False, memory=memory, reason="no documents indexed")
+    if weather and not doc_cue:
+        return RouteDecision(weather=True, documents=False, memory=memory, reason="weather-only question")
+    return RouteDecision(weather=weather, documents=True, memory=memory or doc_cue, reason="weather and documents" if weather else "knowledge question")
+
+
+async def fetch_weather_data(query: str) -> Optional[Dict]:
+    place = get_gazetteer().find(query)
+    if place is None:
+        return {"location": None, "error": "No known location found in the question"}
+    location_name = place["name"]
+    try:
+        data = await weather_client.forecast(place["latitude"], place["longitude"])
+        return {"location": location_name, "country": place["country"], **analyze_forecast(location_name, data.get("hourly", {}), utc_offset_seconds=data.get("utc_offset_seconds", 0))}
     except Exception as e:
         logger.error(f"Weather fetch error: {e}")
         return None
 
 
-async def write_memory(entry: MemoryEntry):
+class MemoryStore:
+    """SQLite-backed memory facts with dedup, pagination and keyword/vector lookup.
+
+    Facts are unique per target after normalizing case and punctuation. An
+    FTS5 table serves keyword lookup; fact embeddings are kept in a numpy
+    matrix for similarity search. Calls are synchronous; run them off the
+    event loop.
+    """
+
+    def __init__(self, db_path: Path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS memories ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE NOT NULL, target TEXT NOT NULL, "
+                "fact TEXT NOT NULL, fact_key TEXT NOT NULL, timestamp TEXT NOT NULL, embedding BLOB, "
+                "UNIQUE (target, fact_key))"
+            )
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5(fact, content='memories', content_rowid='seq')")
+        self._vector_seqs: List[int] = []
+        self._vectors: List[np.ndarray] = []
+        self._matrix: Optional[np.ndarray] = None
+        for seq, blob in self._conn.execute("SELECT seq, embedding FROM memories WHERE embedding IS NOT NULL ORDER BY seq"):
+            self._vector_seqs.append(seq)
+            self._vectors.append(np.frombuffer(blob, dtype=np.float32))
+
+    @staticmethod
+    def fact_key(fact: str) -> str:
+        return re.sub(r"[^a-z0-9]+", " ", fact.lower()).strip()
+
+    @staticmethod
+    def _row(row: Tuple) -> Dict[str, Any]:
+        return {"id": row[0], "target": row[1], "fact": row[2], "timestamp": row[3]}
+
+    def add(self, entry: MemoryEntry, embedding: Optional[List[float]] = None) -> bool:
+        """Insert a fact; returns False if the same fact is already stored for that target"""
+        key = self.fact_key(entry.fact)
+        if not key:
+            return False
+        vector = None
+        if embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO memories (id, target, fact, fact_key, timestamp, embedding) VALUES (?, ?, ?, ?, ?, ?)",
+                (entry.id, entry.target, entry.fact, key, entry.timestamp, vector.tobytes() if vector is not None else None)
+            )
+            if cur.rowcount == 0:
+                return False
+            seq = cur.lastrowid
+            self._conn.execute("INSERT INTO memories_fts (rowid, fact) VALUES (?, ?)", (seq, entry.fact))
+            if vector is not None:
+                self._vector_seqs.append(seq)
+                self._vectors.append(vector)
+                self._matrix = None
+        return True
+
+    def count(self, target: Optional[str] = None) -> int:
+        with self._lock:
+            if target:
+                return self._conn.execute("SELECT COUNT(*) FROM memories WHERE target = ?", (target,)).fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+
+    def page(self, target: str, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, target, fact, timestamp FROM memories WHERE target = ? ORDER BY seq LIMIT ? OFFSET ?",
+                (target, limit, offset)
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def search(self, query: str, embedding: Optional[List[float]] = None, k: int = MEMORY_TOP_K) -> List[Dict[str, Any]]:
+        """Top-k facts for a query, fusing FTS5 keyword ranks with embedding similarity ranks"""
+        fused: Dict[int, float] = {}
+        terms = [t for t in set(re.findall(r"[a-z0-9]+", query.lower())) if len(t) > 2]
+        with self._lock:
+            if terms:
+                match = " OR ".join(f'"{t}"' for t in terms)
+                rows = self._conn.execute(
+                    "SELECT rowid FROM memories_fts WHERE memories_fts MATCH ? ORDER BY rank LIMIT ?",
+                    (match, k * 2)
+                ).fetchall()
+                for rank, (seq,) in enumerate(rows):
+                    fused[seq] = fused.get(seq, 0.0) + 1 / (RRF_K + rank + 1)
+            if embedding is not None and self._vectors:
+                if self._matrix is None:
+                    self._matrix = np.vstack(self._vectors)
+                query_vector = np.asarray(embedding, dtype=np.float32)
+                query_vector /= np.linalg.norm(query_vector) or 1.0
+                similarities = self._matrix @ query_vector
+                top = np.argsort(-similarities)[:k * 2]
+                for rank, idx in enumerate(top):
+                    seq = self._vector_seqs[idx]
+                    fused[seq] = fused.get(seq, 0.0) + 1 / (RRF_K + rank + 1)
+            if not fused:
+                return []
+            best = sorted(fused, key=fused.get, reverse=True)[:k]
+            placeholders = ",".join("?" * len(best))
+            rows = self._conn.execute(
+                f"SELECT seq, id, target, fact, timestamp FROM memories WHERE seq IN ({placeholders})", best
+            ).fetchall()
+        by_seq = {row[0]: self._row(row[1:]) for row in rows}
+        return [by_seq[seq] for seq in best if seq in by_seq]
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM memories")
+            self._conn.execute("INSERT INTO memories_fts (memories_fts) VALUES ('delete-all')")
+            self._vector_seqs.clear()
+            self._vectors.clear()
+            self._matrix = None
+
+    def import_markdown(self, path: Path, target: str) -> int:
+        """One-time migration of facts from a memory markdown file"""
+        if not path.exists():
+            return 0
+        imported = 0
+        for line in path.read_text().splitlines():
+            match = re.match(r"^- \[(.+?)\] (.+)$", line.strip())
+            if match and self.add(MemoryEntry(target=target, fact=match.group(2))):
+                imported += 1
+        return imported
+
+
+memory_store = MemoryStore(MEMORY_DB_PATH)
+if memory_store.count() == 0:
+    for _path, _target in ((USER_MEMORY_PATH, "user"), (COMPANY_MEMORY_PATH, "company")):
+        memory_store.import_markdown(_path, _target)
+
+
+def append_memory_markdown(path: Path, line: str):
+    with open(path, 'a') as f:
+        f.write(line)
+
+
+async def write_memory(entry: MemoryEntry) -> bool:
+    """Store a fact, skipping duplicates; returns whether it was new"""
+    try:
+        embedding = (await embedding_service.embed([entry.fact], priority=EMBED_PRIORITY_INGEST))[0]
+    except Exception as e:
+        logger.warning(f"Memory embedding error: {e}")
+        embedding = None
+    if not await asyncio.to_thread(memory_store.add, entry, embedding):
+        return False
     path = USER_MEMORY_PATH if entry.target == "user" else COMPANY_MEMORY_PATH
     timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M")
-    with open(path, 'a') as f:
-        f.write(f"\n- [{timestamp}] {entry.fact}\n")
+    await asyncio.to_thread(append_memory_markdown, path, f"\n- [{timestamp}] {entry.fact}\n")
     MEMORY_FEED.append({
         "id": entry.id,
         "target": entry.target,
         "fact": entry.fact,
         "timestamp": entry.timestamp
     })
+    return True
 
 
-async def decide_memory(user_message: str, ai_response: str) -> List[MemoryEntry]:
-    """Use Gemini to decide if high-signal facts should be saved to memory"""
+def select_memories(memories: List[Dict[str, Any]], budget: int = MEMORY_PROMPT_TOKENS) -> List[str]:
+    """Memory lines in relevance order, stopping at the prompt token budget"""
+    selected = []
+    used = 0
+    for memory in memories:
+        line = f"- ({memory['target']}) {memory['fact']}"
+        cost = estimate_tokens(line)
+        if used + cost > budget:
+            break
+        selected.append(line)
+        used += cost
+    return selected
+
+
+async def decide_memory(exchanges: List[Tuple[str, str]]) -> List[MemoryEntry]:
+    """Use Gemini to decide if high-signal facts from one or more exchanges should be saved to memory"""
     entries = []
     try:
+        transcript = "\n\n".join(
+            f"Exchange {i}:\nUser: {user_message}\nAssistant: {ai_response}"
+            for i, (user_message, ai_response) in enumerate(exchanges, 1)
+        )
         prompt = (
-            "Analyze this conversation and extract high-signal facts worth remembering.\n"
+            "Analyze these conversations and extract high-signal facts worth remembering.\n"
             "Return ONLY a valid JSON array. Each item: "
             '{\"should_write\": true, \"target\": \"user\" or \"company\", \"fact\": \"string\"}\n'
             "- user target: user preferences, roles, recurring tasks, personal context\n"
             "- company target: org patterns, discovered bugs, workflow insights, team learnings\n"
             "- Only extract genuinely useful, reusable facts. Be selective.\n"
+            "- Do not repeat the same fact across exchanges.\n"
             "- If nothing noteworthy, return: []\n"
             "- Return ONLY the JSON array, no markdown, no explanation.\n\n"
-            f"User: {user_message}\nAssistant: {ai_response}"
+            f"{transcript}"
         )
-        result = gemini_client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt
-        )
-        result_text = result.text.strip()
+        result_text = (await llm_gateway.generate(prompt, priority=LLM_PRIORITY_BACKGROUND)).strip()
         if result_text.startswith("```"):
             result_text = result_text.split("\n", 1)[-1].rsplit("```", 1)[0].strip()
         decisions = json.loads(result_text)
@@ -222,23 +1499,747 @@ async def decide_memory(user_message: str, ai_response: str) -> List[MemoryEntry
     return entries
 
 
-def build_system_prompt(context: str, weather_data: Optional[Dict], has_context: bool) -> str:
+class MemoryWorker:
+    """Background queue that extracts memory from finished exchanges in batches.
+
+    Exchanges are collected until MEMORY_BATCH_SIZE is reached or
+    MEMORY_BATCH_WAIT_SECONDS have passed since the first one, then sent to
+    decide_memory() as a single prompt.
+    """
+
+    def __init__(self, batch_size: int, max_wait: float):
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def submit(self, user_message: str, ai_response: str) -> bool:
+        if self._queue is None:
+            return False
+        self._queue.put_nowait((user_message, ai_response))
+        return True
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def _next_batch(self) -> List[Tuple[str, str]]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            started = time.perf_counter()
+            try:
+                entries = await decide_memory(batch)
+                written = 0
+                for entry in entries:
+                    written += await write_memory(entry)
+                logger.info(f"Memory worker: {written} new of {len(entries)} fact(s) from {len(batch)} exchange(s)")
+            except Exception as e:
+                logger.warning(f"Memory worker error: {e}")
+            MEMORY_EXTRACTION_SECONDS.observe(time.perf_counter() - started)
+
+
+memory_worker = MemoryWorker(MEMORY_BATCH_SIZE, MEMORY_BATCH_WAIT_SECONDS)
+metrics.callback("rag_memory_queue_depth", "Exchanges waiting for memory extraction.", "gauge",
+                 lambda: {(): memory_worker.pending})
+
+
+# --- Conversation history ---
+class Session:
+    def __init__(self):
+        self.turns: deque = deque()  # (user_message, ai_response, tokens)
+        self.tokens = 0
+        self.summary = ""
+        self.updated = time.monotonic()
+        self.summarizing = False
+
+
+class ConversationStore:
+    """Per-session conversation history, bounded in sessions and in tokens per session.
+
+    Sessions are kept in LRU order (at most ``max_sessions``) and expire
+    after ``ttl`` seconds idle. Once a session's turns exceed
+    ``history_tokens``, the oldest ones are rolled into a running summary
+    of at most ``summary_tokens``.
+    """
+
+    def __init__(self, max_sessions: int, ttl: float, history_tokens: int, summary_tokens: int):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.updated >= cutoff and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+    def _get(self, session_id: str, create: bool = False) -> Optional[Session]:
+        self._expire()
+        session = self._sessions.get(session_id)
+        if session is None and create:
+            session = self._sessions[session_id] = Session()
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def render(self, session_id: str) -> str:
+        """Summary plus recent turns for the prompt; empty for a new session"""
+        session = self._get(session_id)
+        if session is None:
+            return ""
+        lines = []
+        if session.summary:
+            lines.append(f"Summary of earlier conversation: {session.summary}")
+        for user_message, ai_response, _ in session.turns:
+            lines.append(f"User: {user_message}\nAssistant: {ai_response}")
+        return "\n".join(lines)
+
+    def append(self, session_id: str, user_message: str, ai_response: str):
+        session = self._get(session_id, create=True)
+        # A single turn may not take more than half the history budget
+        max_chars = self.history_tokens * 2
+        user_message, ai_response = user_message[:max_chars // 2], ai_response[:max_chars // 2]
+        tokens = estimate_tokens(user_message) + estimate_tokens(ai_response)
+        session.turns.append((user_message, ai_response, tokens))
+        session.tokens += tokens
+        session.updated = time.monotonic()
+        self._expire()
+        if session.tokens > self.history_tokens and not session.summarizing:
+            session.summarizing = True
+            task = asyncio.create_task(self._summarize(session))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(self, session: Session):
+        """Fold the oldest turns into the running summary until history is back under half its budget"""
+        try:
+            # Turns stay in the history until the summary that covers them is ready
+            rolled = []
+            remaining = session.tokens
+            for user_message, ai_response, tokens in session.turns:
+                if remaining <= self.history_tokens // 2:
+                    break
+                remaining -= tokens
+                rolled.append(f"User: {user_message}\nAssistant: {ai_response}")
+            if not rolled:
+                return
+            words = self.summary_tokens * 3 // 4
+            prompt = (
+                f"Update this running summary of a conversation in at most {words} words. "
+                "Keep names, numbers, decisions and open questions; drop pleasantries.\n\n"
+                f"Current summary: {session.summary or '(none)'}\n\nNew turns:\n" + "\n".join(rolled)
+            )
+            try:
+                summary = (await llm_gateway.generate(prompt, priority=LLM_PRIORITY_BACKGROUND)).strip()
+            except Exception as e:
+                logger.warning(f"Conversation summary error: {e}")
+                summary = " ".join([session.summary] + [turn.split("\n")[0] for turn in rolled]).strip()
+            # Only this task removes turns and new ones are appended on the right, so the rolled turns are still the oldest
+            for _ in rolled:
+                session.tokens -= session.turns.popleft()[2]
+            session.summary = summary[-self.summary_tokens * 4:]
+        finally:
+            session.summarizing = False
+
+    def clear(self):
+        self._sessions.clear()
+
+
+conversation_store = ConversationStore(SESSION_MAX, SESSION_TTL_SECONDS, SESSION_HISTORY_TOKENS, SESSION_SUMMARY_TOKENS)
+
+
+def build_system_prompt(
+    context: str,
+    weather_data: Optional[Dict],
+    has_context: bool,
+    memories: Optional[List[str]] = None,
+    history: str = ""
+) -> str:
     prompt = (
         "You are an Agentic RAG Knowledge Assistant for a SaaS platform.\n\n"
         "RULES:\n"
         "1. If document context is provided, answer based on that context and cite sources with [Source: filename, Chunk N].\n"
         "2. If no relevant documents found for a docs query, say: \"I couldn't find that in your files.\"\n"
-        "3. If weather data is provided, analyze it thoroughly - compute rolling averages, volatility, and explain findings.\n"
+        "3. If weather data is provided, explain the precomputed analytics (rolling means, volatility, trends, daily ranges). Do not recompute them. "
+        "If it reports an error such as an unknown location, tell the user and ask which city they mean.\n"
         "4. Use markdown formatting. Use code blocks for technical content.\n"
         "5. Be concise but thorough.\n"
+        "6. Use relevant memory to personalize answers, but never cite it as a document source.\n"
+        "7. Use the conversation so far to resolve follow-up questions.\n"
     )
+    if history:
+        prompt += f"\n## Conversation So Far:\n{history}\n"
+    if memories:
+        prompt += "\n## Relevant Memory:\n" + "\n".join(memories) + "\n"
     if has_context:
         prompt += f"\n## Retrieved Document Context:\n{context}\n"
     if weather_data:
-        prompt += f"\n## Weather Data (from Open-Meteo):\n{json.dumps(weather_data, indent=2)}\n"
+        prompt += f"\n## Weather Analytics (from Open-Meteo, precomputed):\n{json.dumps(weather_data, separators=(',', ':'))}\n"
     return prompt
 
 
+# --- Lexical index ---
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_.:/][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; compound identifiers (E-1234, sku_99.1) are kept whole and also split"""
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(re.split(r"[-_.:/]", token))
+    return tokens
+
+
+def is_identifier(token: str) -> bool:
+    return any(ch.isdigit() for ch in token) and any(ch.isalpha() for ch in token)
+
+
+class BM25Index:
+    """Incrementally maintained BM25 inverted index over chunk ids"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_terms: Dict[str, List[str]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, ids: List[str], texts: List[str]):
+        for chunk_id, text in zip(ids, texts):
+            if chunk_id in self.doc_lengths:
+                self.remove([chunk_id])
+            tokens = tokenize(text)
+            counts = Counter(tokens)
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[chunk_id] = tf
+            self.doc_terms[chunk_id] = list(counts)
+            self.doc_lengths[chunk_id] = len(tokens)
+            self.total_length += len(tokens)
+
+    def remove(self, ids: List[str]):
+        for chunk_id in ids:
+            if chunk_id not in self.doc_lengths:
+                continue
+            for term in self.doc_terms.pop(chunk_id):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self.postings[term]
+            self.total_length -= self.doc_lengths.pop(chunk_id)
+
+    def clear(self):
+        self.postings.clear()
+        self.doc_terms.clear()
+        self.doc_lengths.clear()
+        self.total_length = 0
+
+    def search(self, query: str, k: int, require: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        """Top-k (chunk_id, score); `require` restricts hits to chunks containing all of those terms"""
+        n = len(self.doc_lengths)
+        if n == 0:
+            return []
+        avg_len = self.total_length / n
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_lengths[chunk_id] / avg_len)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        if require:
+            allowed = set(scores)
+            for term in require:
+                allowed &= set(self.postings.get(term, ()))
+            scores = {chunk_id: score for chunk_id, score in scores.items() if chunk_id in allowed}
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+bm25_index = BM25Index()
+
+
+def rebuild_lexical_index(page_size: int = 1000):
+    """Load the BM25 index from chunks already in Chroma (persistent mode warm start)"""
+    bm25_index.clear()
+    offset = 0
+    while True:
+        page = collection.get(include=["documents"], limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        bm25_index.add(page['ids'], page['documents'])
+        offset += len(page['ids'])
+
+
+# --- Deduplication ---
+_uploads_in_progress: Dict[str, asyncio.Future] = {}
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+async def hash_upload(file: UploadFile) -> str:
+    """SHA-256 of the upload, read in pieces; the file is rewound for ingestion"""
+    digest = hashlib.sha256()
+    while piece := await file.read(INGEST_READ_SIZE):
+        digest.update(piece)
+    await file.seek(0)
+    return digest.hexdigest()
+
+
+async def embed_chunks(chunks: List[str], chunk_hashes: List[str]) -> Tuple[List[List[float]], int]:
+    """Embed chunks, reusing vectors already stored in Chroma for identical chunk text.
+
+    Returns the embeddings in input order and how many chunks were reused.
+    """
+    text_by_hash = dict(zip(chunk_hashes, chunks))
+    known: Dict[str, List[float]] = {}
+    existing = await asyncio.to_thread(
+        collection.get,
+        where={"chunk_hash": {"$in": list(text_by_hash)}},
+        include=["embeddings", "metadatas"]
+    )
+    for meta, vector in zip(existing['metadatas'] or [], existing['embeddings'] if existing['embeddings'] is not None else []):
+        known.setdefault(meta['chunk_hash'], [float(x) for x in vector])
+    missing = [h for h in text_by_hash if h not in known]
+    vectors = await embedding_service.embed([text_by_hash[h] for h in missing], priority=EMBED_PRIORITY_INGEST)
+    known.update(zip(missing, vectors))
+    reused = sum(1 for h in chunk_hashes if h not in missing)
+    return [known[h] for h in chunk_hashes], reused
+
+
+async def ingest_upload(file: UploadFile, ext: str, content_hash: str) -> Dict[str, Any]:
+    doc_id = str(uuid.uuid4())
+    chunker = SentenceChunker(CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS)
+    pending: List[Dict[str, Any]] = []
+    chunk_count = 0
+    reused_count = 0
+    stage_seconds = {"parse": 0.0, "chunk": 0.0, "embed": 0.0, "index": 0.0}
+
+    async def index_pending():
+        nonlocal chunk_count, reused_count
+        texts = [chunk["text"] for chunk in pending]
+        chunk_hashes = [hash_text(text) for text in texts]
+        ids = [f"{doc_id}_{chunk_count + i}" for i in range(len(pending))]
+        metadatas = [
+            {
+                "source": file.filename,
+                "chunk_index": chunk_count + i,
+                "doc_id": doc_id,
+                "chunk_hash": chunk_hashes[i],
+                **{key: value for key, value in chunk.items() if key != "text"}
+            }
+            for i, chunk in enumerate(pending)
+        ]
+        started = time.perf_counter()
+        embeddings, reused = await embed_chunks(texts, chunk_hashes)
+        embedded = time.perf_counter()
+        await asyncio.to_thread(collection.add, documents=texts, embeddings=embeddings, ids=ids, metadatas=metadatas)
+        bm25_index.add(ids, texts)
+        stage_seconds["embed"] += embedded - started
+        stage_seconds["index"] += time.perf_counter() - embedded
+        chunk_count += len(pending)
+        reused_count += reused
+        pending.clear()
+
+    try:
+        mark = time.perf_counter()
+        async for segment, page in iter_upload_text(file, ext):
+            fed = time.perf_counter()
+            pending.extend(chunker.feed(segment, page))
+            stage_seconds["parse"] += fed - mark
+            stage_seconds["chunk"] += time.perf_counter() - fed
+            if len(pending) >= INGEST_CHUNK_BATCH:
+                await index_pending()
+            mark = time.perf_counter()
+        pending.extend(chunker.finish())
+        if pending:
+            await index_pending()
+    except BaseException:
+        # Also covers cancelled uploads, which would otherwise leave unregistered chunks behind
+        if chunk_count:
+            added_ids = [f"{doc_id}_{i}" for i in range(chunk_count)]
+            bm25_index.remove(added_ids)
+            await asyncio.to_thread(collection.delete, ids=added_ids)
+        raise
+
+    if chunk_count == 0:
+        raise HTTPException(400, "Could not extract text from file")
+    for stage, seconds in stage_seconds.items():
+        INGEST_STAGE_SECONDS.observe(seconds, stage=stage)
+
+    doc_info = {
+        "id": doc_id,
+        "filename": file.filename,
+        "file_type": ext,
+        "chunks": chunk_count,
+        "chunk_range": [0, chunk_count],
+        "reused_chunks": reused_count,
+        "content_hash": content_hash,
+        "uploaded_at": datetime.now(timezone.utc).isoformat()
+    }
+    document_registry.add(doc_info)
+    answer_cache.invalidate()
+    return doc_info
+
+
+# --- Retrieval ---
+def chunk_from_result(chunk_id: str, text: str, meta: Dict[str, Any], distance: Optional[float]) -> Dict[str, Any]:
+    return {
+        'id': chunk_id,
+        'text': text,
+        'source': meta.get('source', 'unknown'),
+        'chunk_index': meta.get('chunk_index', 0),
+        'page': meta.get('page_start'),
+        'doc_id': meta.get('doc_id') or chunk_id.rsplit('_', 1)[0],
+        'distance': distance
+    }
+
+
+def exact_lookup_terms(query: str) -> List[str]:
+    """Identifier tokens of the query, if every one of them is in the lexical index"""
+    identifiers = [t for t in set(tokenize(query)) if is_identifier(t)]
+    if identifiers and all(t in bm25_index.postings for t in identifiers):
+        return identifiers
+    return []
+
+
+async def hybrid_search(query: str, k: int = RETRIEVAL_TOP_K, query_embedding: Optional[List[float]] = None) -> Tuple[List[Dict[str, Any]], str]:
+    """BM25 + vector search fused with reciprocal rank fusion, then reranked with MMR.
+
+    Queries naming identifiers (error codes, SKUs) that the lexical index
+    contains are answered from BM25 alone, skipping the embedding call.
+    Otherwise RETRIEVAL_CANDIDATES are over-fetched from both indexes,
+    candidates beyond RETRIEVAL_MAX_DISTANCE are dropped unless BM25 matched
+    them, MMR picks k diverse chunks, and strong hits bring their neighbours.
+    Returns the chunks and the retrieval mode used.
+    """
+    count = collection.count()
+    if count == 0:
+        return [], "empty"
+
+    identifiers = exact_lookup_terms(query)
+    if identifiers:
+        exact = bm25_index.search(query, k, require=identifiers)
+        if exact:
+            ids = [chunk_id for chunk_id, _ in exact]
+            found = await asyncio.to_thread(collection.get, ids=ids, include=["documents", "metadatas"])
+            by_id = {cid: chunk_from_result(cid, doc, meta, None) for cid, doc, meta in zip(found['ids'], found['documents'], found['metadatas'])}
+            return [by_id[cid] for cid in ids if cid in by_id], "lexical"
+
+    n_candidates = min(max(k, RETRIEVAL_CANDIDATES), count)
+    if query_embedding is None:
+        query_embedding = (await embedding_service.embed([query]))[0]
+    results = await asyncio.to_thread(
+        collection.query,
+        query_embeddings=[query_embedding],
+        n_results=n_candidates,
+        include=["documents", "metadatas", "distances", "embeddings"]
+    )
+    candidates: Dict[str, Dict[str, Any]] = {}
+    vectors: Dict[str, np.ndarray] = {}
+    fused: Dict[str, float] = {}
+    if results and results['ids'] and results['ids'][0]:
+        for rank, (cid, doc, meta, dist, vector) in enumerate(zip(
+            results['ids'][0],
+            results['documents'][0],
+            results['metadatas'][0],
+            results['distances'][0],
+            results['embeddings'][0]
+        )):
+            candidates[cid] = chunk_from_result(cid, doc, meta, dist)
+            vectors[cid] = np.asarray(vector, dtype=np.float32)
+            fused[cid] = 1 / (RRF_K + rank + 1)
+
+    lexical = set()
+    for rank, (cid, _) in enumerate(bm25_index.search(query, n_candidates)):
+        lexical.add(cid)
+        fused[cid] = fused.get(cid, 0.0) + 1 / (RRF_K + rank + 1)
+
+    missing = [cid for cid in fused if cid not in candidates]
+    if missing:
+        found = await asyncio.to_thread(collection.get, ids=missing, include=["documents", "metadatas", "embeddings"])
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+        for cid, doc, meta, vector in zip(found['ids'], found['documents'], found['metadatas'], found['embeddings']):
+            vectors[cid] = np.asarray(vector, dtype=np.float32)
+            similarity = float(vectors[cid] @ query_vector) / (float(np.linalg.norm(vectors[cid])) or 1.0)
+            candidates[cid] = chunk_from_result(cid, doc, meta, 1.0 - similarity)
+
+    # Semantically distant candidates are dropped unless BM25 matched them
+    pool = [
+        cid for cid in sorted(fused, key=fused.get, reverse=True)
+        if cid in candidates and (cid in lexical or candidates[cid]['distance'] <= RETRIEVAL_MAX_DISTANCE)
+    ]
+    top_ids = mmr_select(pool, [fused[cid] for cid in pool], [vectors[cid] for cid in pool], k)
+    chunks = [candidates[cid] for cid in top_ids]
+    if RETRIEVAL_NEIGHBORS:
+        chunks = await stitch_neighbors(chunks)
+    return chunks, "hybrid"
+
+
+def mmr_select(ids: List[str], relevance: List[float], vectors: List[np.ndarray], k: int, lam: float = MMR_LAMBDA) -> List[str]:
+    """Maximal marginal relevance: pick k ids trading relevance against similarity to ones already picked"""
+    if len(ids) <= 1:
+        return ids[:k]
+    matrix = np.vstack(vectors)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+    scores = np.asarray(relevance, dtype=np.float32)
+    scores = (scores - scores.min()) / ((scores.max() - scores.min()) or 1.0)
+    similarity = matrix @ matrix.T
+    picked = [int(np.argmax(scores))]
+    max_similarity = similarity[picked[0]].copy()
+    available = np.ones(len(ids), dtype=bool)
+    available[picked[0]] = False
+    while len(picked) < min(k, len(ids)):
+        mmr = np.where(available, lam * scores - (1 - lam) * max_similarity, -np.inf)
+        best = int(np.argmax(mmr))
+        picked.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+    return [ids[i] for i in picked]
+
+
+async def stitch_neighbors(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Add the chunk_index ± 1 neighbours of strong hits right after them.
+
+    Chunk ids are ``{doc_id}_{chunk_index}``, so neighbours are fetched by id
+    without a metadata query; ids past either end of a document simply miss.
+    """
+    have = {chunk['id'] for chunk in chunks}
+    wanted: Dict[str, List[str]] = {}
+    for chunk in chunks:
+        if chunk['distance'] is None or chunk['distance'] > RETRIEVAL_NEIGHBOR_DISTANCE:
+            continue
+        for index in (chunk['chunk_index'] - 1, chunk['chunk_index'] + 1):
+            neighbor_id = f"{chunk['doc_id']}_{index}"
+            if index >= 0 and neighbor_id not in have:
+                have.add(neighbor_id)
+                wanted.setdefault(chunk['id'], []).append(neighbor_id)
+    if not wanted:
+        return chunks
+    found = await asyncio.to_thread(
+        collection.get,
+        ids=[nid for ids in wanted.values() for nid in ids],
+        include=["documents", "metadatas"]
+    )
+    by_id = {cid: chunk_from_result(cid, doc, meta, None) for cid, doc, meta in zip(found['ids'], found['documents'], found['metadatas'])}
+    stitched = []
+    for chunk in chunks:
+        stitched.append(chunk)
+        stitched.extend(by_id[nid] for nid in wanted.get(chunk['id'], []) if nid in by_id)
+    return stitched
+
+
+# --- Context assembly ---
+def word_overlap(left: List[str], right: List[str], max_words: int = 200) -> int:
+    """Length of the longest suffix of ``left`` that is a prefix of ``right``"""
+    for n in range(min(len(left), len(right), max_words), 0, -1):
+        if left[-n:] == right[:n]:
+            return n
+    return 0
+
+
+def assemble_context(chunks: List[Dict[str, Any]], budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[str, List[Dict[str, Any]]]:
+    """Build the prompt context from retrieved chunks within a token budget.
+
+    Chunks are taken in relevance order while they fit. A chunk adjacent to
+    one already taken from the same document only costs its new words, and
+    adjacent chunks are merged into one passage with the sliding-window
+    overlap removed. Identical chunk text is included once. Returns the
+    context text and the chunks it uses, in relevance order.
+    """
+    selected: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    words: Dict[Tuple[str, int], List[str]] = {}
+    seen_text: Set[str] = set()
+    used = 0
+    for chunk in chunks:
+        key = (chunk['doc_id'], chunk['chunk_index'])
+        if key in selected or chunk['text'] in seen_text:
+            continue
+        chunk_words = chunk['text'].split()
+        new_words = chunk_words
+        before = words.get((key[0], key[1] - 1))
+        if before:
+            new_words = new_words[word_overlap(before, new_words):]
+        after = words.get((key[0], key[1] + 1))
+        if after:
+            new_words = new_words[:len(new_words) - word_overlap(new_words, after)]
+        cost = estimate_tokens(" ".join(new_words)) + estimate_tokens(f"[Source: {chunk['source']}, Chunk {key[1] + 1}]")
+        if used + cost > budget:
+            if selected:
+                continue
+            # Always keep something from the best chunk
+            keep = max(1, (budget * 4) // 6)
+            chunk_words = chunk_words[:keep]
+            chunk = {**chunk, 'text': " ".join(chunk_words)}
+            cost = budget
+        selected[key] = chunk
+        words[key] = chunk_words
+        seen_text.add(chunk['text'])
+        used += cost
+
+    # Group selected chunks into runs of consecutive indexes per document
+    rank = {key: i for i, key in enumerate(selected)}
+    runs: List[List[Tuple[str, int]]] = []
+    for key in sorted(selected):
+        if runs and runs[-1][-1] == (key[0], key[1] - 1):
+            runs[-1].append(key)
+        else:
+            runs.append([key])
+    runs.sort(key=lambda run: min(rank[k] for k in run))
+
+    passages = []
+    for run in runs:
+        merged = list(words[run[0]])
+        for key in run[1:]:
+            merged.extend(words[key][word_overlap(merged, words[key]):])
+        first, last = run[0][1] + 1, run[-1][1] + 1
+        label = f"Chunk {first}" if first == last else f"Chunks {first}-{last}"
+        if selected[run[0]].get('page'):
+            label += f", Page {selected[run[0]]['page']}"
+        passages.append(f"[Source: {selected[run[0]]['source']}, {label}]\n{' '.join(merged)}")
+    return "\n\n".join(passages), list(selected.values())
+
+
+# --- Answer cache ---
+class AnswerCache:
+    """LRU + TTL cache of chat answers, matched by exact query text or query embedding similarity.
+
+    Every entry belongs to one corpus version; invalidate() bumps the version
+    and drops all entries whenever the indexed documents change.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, threshold: float):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.threshold = threshold
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._keys: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def invalidate(self):
+        self.version += 1
+        self._entries.clear()
+        self._matrix = None
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if entry['expires'] <= now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _similar_key(self, embedding: List[float]) -> Optional[str]:
+        if self._matrix is None:
+            self._keys = [key for key, entry in self._entries.items() if entry['embedding'] is not None]
+            self._matrix = np.array([self._entries[key]['embedding'] for key in self._keys]) if self._keys else np.empty((0, 0))
+        if not self._keys:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        similarities = self._matrix @ query
+        best = int(np.argmax(similarities))
+        return self._keys[best] if similarities[best] >= self.threshold else None
+
+    def lookup(self, query: str, embedding: Optional[List[float]] = None) -> Optional[Dict[str, Any]]:
+        self._expire()
+        key = self.normalize(query)
+        if key not in self._entries and embedding is not None:
+            key = self._similar_key(embedding)
+        if key is None or key not in self._entries:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key]
+
+    def put(self, query: str, embedding: Optional[List[float]], version: int, response: str, citations: List[Citation]):
+        if version != self.version:
+            return
+        if embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            embedding = vector / (np.linalg.norm(vector) or 1.0)
+        self._entries[self.normalize(query)] = {
+            'embedding': embedding,
+            'response': response,
+            'citations': citations,
+            'expires': time.monotonic() + self.ttl
+        }
+        self._entries.move_to_end(self.normalize(query))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._matrix = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "corpus_version": self.version
+        }
+
+
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_THRESHOLD)
+metrics.callback("rag_answer_cache_lookups_total", "Answer cache lookups by result.", "counter",
+                 lambda: {(("result", "hit"),): answer_cache.hits, (("result", "miss"),): answer_cache.misses})
+metrics.callback("rag_weather_requests_total", "Forecast requests served from cache or fetched from Open-Meteo.", "counter",
+                 lambda: {(("result", "hit"),): weather_client.cache_hits, (("result", "upstream"),): weather_client.upstream_calls})
+
+
 # --- Routes ---
 @api_router.get("/")
 async def root():
@@ -250,8 +2251,13 @@ async def health_check():
     return {
         "status": "ok",
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "storage": "in-memory",
-        "documents_indexed": collection.count()
+        "storage": "persistent" if STORAGE_MODE == "persistent" else "in-memory",
+        "storage_load_seconds": STORAGE_LOAD_SECONDS,
+        "documents_registered": len(document_registry),
+        "documents_indexed": collection.count(),
+        "answer_cache": answer_cache.stats(),
+        "sessions": len(conversation_store),
+        "llm": llm_gateway.stats()
     }
 
 
@@ -262,164 +2268,435 @@ async def upload_document(file: UploadFile = File(...)):
     if ext not in allowed:
         raise HTTPException(400, f"Unsupported file type. Allowed: {', '.join(allowed)}")
 
-    content = await file.read()
-    text = parse_file(content, file.filename)
-    if not text.strip():
-        raise HTTPException(400, "Could not extract text from file")
-
-    chunks = chunk_text(text)
-    doc_id = str(uuid.uuid4())
+    content_hash = await hash_upload(file)
+    existing = document_registry.find_by_hash(content_hash)
+    if existing is None and content_hash in _uploads_in_progress:
+        existing = await asyncio.shield(_uploads_in_progress[content_hash])
+    if existing is not None:
+        return {"id": existing["id"], "filename": existing["filename"], "chunks": existing["chunks"], "status": "duplicate"}
 
-    ids = [f"{doc_id}_{i}" for i in range(len(chunks))]
-    metadatas = [{"source": file.filename, "chunk_index": i, "doc_id": doc_id} for i in range(len(chunks))]
-    collection.add(documents=chunks, ids=ids, metadatas=metadatas)
+    in_progress = asyncio.get_running_loop().create_future()
+    _uploads_in_progress[content_hash] = in_progress
+    try:
+        doc_info = await ingest_upload(file, ext, content_hash)
+        in_progress.set_result(doc_info)
+    except BaseException:
+        in_progress.set_result(None)
+        raise
+    finally:
+        del _uploads_in_progress[content_hash]
 
-    doc_info = {
-        "id": doc_id,
+    return {
+        "id": doc_info["id"],
         "filename": file.filename,
-        "file_type": ext,
-        "chunks": len(chunks),
-        "uploaded_at": datetime.now(timezone.utc).isoformat()
+        "chunks": doc_info["chunks"],
+        "reused_chunks": doc_info["reused_chunks"],
+        "status": "indexed"
     }
-    DOCUMENTS_STORE.append(doc_info)
-
-    return {"id": doc_id, "filename": file.filename, "chunks": len(chunks), "status": "indexed"}
 
 
 @api_router.get("/documents")
-async def list_documents():
-    return DOCUMENTS_STORE.copy()
+async def list_documents(offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    return {
+        "documents": document_registry.list(offset, limit),
+        "offset": offset,
+        "limit": limit,
+        "total": len(document_registry)
+    }
+
+
+class BulkDeleteRequest(BaseModel):
+    ids: List[str]
+
+
+async def delete_documents(doc_ids: List[str]) -> int:
+    """Remove documents and their chunks using the chunk ids recorded at ingestion"""
+    removed = document_registry.remove(doc_ids)
+    chunk_ids = [chunk_id for doc in removed for chunk_id in document_chunk_ids(doc)]
+    if chunk_ids:
+        try:
+            await asyncio.to_thread(collection.delete, ids=chunk_ids)
+        except Exception as e:
+            logger.warning(f"Chunk delete error: {e}")
+        bm25_index.remove(chunk_ids)
+    if removed:
+        answer_cache.invalidate()
+    return len(removed)
 
 
 @api_router.delete("/documents/{doc_id}")
 async def delete_document(doc_id: str):
-    try:
-        results = collection.get(where={"doc_id": doc_id})
-        if results['ids']:
-            collection.delete(ids=results['ids'])
-    except Exception:
-        pass
-    global DOCUMENTS_STORE
-    DOCUMENTS_STORE[:] = [doc for doc in DOCUMENTS_STORE if doc["id"] != doc_id]
+    await delete_documents([doc_id])
     return {"status": "deleted"}
 
 
-@api_router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    thoughts = []
-    citations = []
+@api_router.post("/documents/bulk-delete")
+async def bulk_delete_documents(request: BulkDeleteRequest):
+    deleted = await delete_documents(request.ids)
+    return {"status": "deleted", "deleted": deleted}
 
-    # Step 1: Weather detection
-    weather_data = None
-    weather_kws = ['weather', 'temperature', 'forecast', 'climate', 'rain', 'wind', 'humidity', 'hot', 'cold']
-    is_weather = any(kw in request.message.lower() for kw in weather_kws)
 
-    if is_weather:
-        thoughts.append(ThoughtStep(step="Weather Detection", detail="Weather query detected. Calling Open-Meteo API..."))
-        weather_data = await fetch_weather_data(request.message)
-        if weather_data:
-            thoughts.append(ThoughtStep(step="Weather Data Retrieved", detail=f"Got data for {weather_data['location']}: {weather_data['summary']}"))
+class Deadline:
+    """Per-request time budget shared by every stage of the chat pipeline.
+
+    Stages before generation leave ``reserve`` seconds unspent so the LLM
+    still gets time to answer with whatever context was gathered.
+    """
+
+    def __init__(self, seconds: float, reserve: float = 0.0):
+        self.seconds = seconds
+        self.reserve = min(reserve, seconds / 2)
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self, reserve: float = 0.0) -> float:
+        return max(0.0, self.expires - time.monotonic() - reserve)
+
+    async def run(self, awaitable, reserved: bool = True):
+        """Await a stage within the time left; on expiry it is cancelled and TimeoutError raised"""
+        remaining = self.remaining(self.reserve if reserved else 0.0)
+        if remaining <= 0:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise asyncio.TimeoutError()
+        return await asyncio.wait_for(awaitable, remaining)
+
+    def skipped(self, stage: str, detail: str) -> Tuple[str, str]:
+        """(step, detail) for the thought reporting a stage cut by the deadline"""
+        return f"{stage} Skipped", f"Request deadline of {self.seconds:g}s reached; {detail}"
+
+
+class PipelineStep:
+    """A unit of the chat pipeline that can start once the steps named in ``after`` have finished"""
 
-    # Step 2: Hybrid retrieval
-    thoughts.append(ThoughtStep(step="Searching Documents", detail="Performing semantic search in ChromaDB..."))
+    def __init__(self, name: str, run: Callable[[], Any], after: Tuple[str, ...] = ()):
+        self.name = name
+        self.run = run
+        self.after = after
+
+
+async def run_steps(steps: List[PipelineStep], deadline: Deadline, results: Dict[str, Any]) -> AsyncIterator[Tuple[str, str, float]]:
+    """Run steps concurrently as soon as their dependencies allow.
+
+    Dependencies on steps that are not in the graph count as met. Results
+    are stored in ``results`` by step name (None on timeout or error) and
+    each transition is yielded as (event, step name, monotonic time) with
+    event "start", "done", "timeout" or "error". Closing the iterator
+    cancels whatever is still running.
+    """
+    names = {step.name for step in steps}
+    pending = {step.name: step for step in steps}
+    finished: Set[str] = set()
+    running: Dict[asyncio.Task, PipelineStep] = {}
+    try:
+        while pending or running:
+            for step in list(pending.values()):
+                if all(dep in finished or dep not in names for dep in step.after):
+                    del pending[step.name]
+                    running[asyncio.create_task(deadline.run(step.run()))] = step
+                    yield "start", step.name, time.monotonic()
+            if not running:
+                break
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                step = running.pop(task)
+                finished.add(step.name)
+                error = task.exception()
+                results[step.name] = None if error else task.result()
+                if isinstance(error, asyncio.TimeoutError):
+                    yield "timeout", step.name, time.monotonic()
+                elif error:
+                    logger.warning(f"Pipeline step {step.name} failed: {error}")
+                    yield "error", step.name, time.monotonic()
+                else:
+                    yield "done", step.name, time.monotonic()
+    finally:
+        for task in running:
+            task.cancel()
+
+
+async def chat_events(request: ChatRequest) -> AsyncIterator[Tuple[str, Any]]:
+    """Run the chat pipeline, yielding (event, payload) pairs as each stage completes.
+
+    Events: "thought" (ThoughtStep), "token" (str), "citations" (List[Citation]),
+    "memory" (List[MemoryEntry]).
+
+    Weather, query embedding, the answer cache, document search and memory
+    recall form a dependency graph run by run_steps(), so independent I/O
+    (e.g. Open-Meteo and Chroma) overlaps. Generation and the memory
+    decision follow once the graph is done.
+
+    Every stage runs against the request deadline (CHAT_DEADLINE_SECONDS, or
+    the request's timeout_seconds up to CHAT_MAX_DEADLINE_SECONDS). Stages
+    that run out of time are cancelled and reported as skipped.
+    """
+    request_started = time.monotonic()
+    deadline = Deadline(
+        min(request.timeout_seconds or CHAT_DEADLINE_SECONDS, CHAT_MAX_DEADLINE_SECONDS),
+        CHAT_ANSWER_RESERVE_SECONDS
+    )
+
+    def thought(step: str, detail: str, started: Optional[float] = None, ended: Optional[float] = None) -> ThoughtStep:
+        now = time.monotonic()
+        started = now if started is None else started
+        ended = now if ended is None else ended
+        return ThoughtStep(
+            step=step,
+            detail=detail,
+            started_ms=round((started - request_started) * 1000, 1),
+            ended_ms=round((ended - request_started) * 1000, 1),
+            duration_ms=round((ended - started) * 1000, 1)
+        )
+
+    # Step 0: Intent routing
+    route = route_query(request.message, collection.count())
+    yield "thought", thought("Routing", route.describe())
+
+    is_weather = route.weather
+    history = conversation_store.render(request.session_id)
+    # Weather answers depend on live data and follow-ups on the conversation, so neither is cached
+    cacheable = not is_weather and not history
+    cache_version = answer_cache.version
+    results: Dict[str, Any] = {}
+
+    async def embed_query():
+        return (await embedding_service.embed([request.message]))[0]
+
+    async def lookup_cache():
+        return answer_cache.lookup(request.message, results.get("embedding"))
+
+    async def search_documents():
+        retrieved, mode = await hybrid_search(request.message, query_embedding=results.get("embedding"))
+        return retrieved, mode, assemble_context(retrieved)
+
+    async def recall_memory():
+        recalled = await asyncio.to_thread(memory_store.search, request.message, results.get("embedding"))
+        return select_memories(recalled)
+
+    steps = []
+    if is_weather:
+        steps.append(PipelineStep("weather", lambda: fetch_weather_data(request.message)))
+    elif route.documents and not exact_lookup_terms(request.message):
+        steps.append(PipelineStep("embedding", embed_query))
+    if cacheable:
+        steps.append(PipelineStep("cache", lookup_cache, after=("embedding",)))
+    if route.documents:
+        steps.append(PipelineStep("documents", search_documents, after=("embedding", "cache")))
+    if not SMALL_TALK_RE.match(request.message):
+        steps.append(PipelineStep("memory_recall", recall_memory, after=("embedding", "cache")))
+
+    start_messages = {
+        "weather": ("Weather Detection", "Weather query detected. Calling Open-Meteo API..."),
+        "documents": ("Searching Documents", "Performing hybrid search (BM25 + semantic) in ChromaDB..."),
+    }
+    skip_messages = {
+        "weather": ("Weather", "answering without live weather data"),
+        "documents": ("Document Search", "answering without document context"),
+        "memory_recall": ("Memory Recall", "answering without stored memories"),
+    }
+    started_at: Dict[str, float] = {}
+    weather_data = None
+    context_text = ""
     context_chunks = []
+    memories = []
+    events = run_steps(steps, deadline, results)
     try:
-        count = collection.count()
-        if count > 0:
-            results = collection.query(query_texts=[request.message], n_results=min(5, count))
-            if results and results['documents'] and results['documents'][0]:
-                for doc, meta, dist in zip(
-                    results['documents'][0],
-                    results['metadatas'][0],
-                    results['distances'][0]
-                ):
-                    context_chunks.append({
-                        'text': doc,
-                        'source': meta.get('source', 'unknown'),
-                        'chunk_index': meta.get('chunk_index', 0),
-                        'distance': dist
-                    })
-                    citations.append(Citation(
-                        source=meta.get('source', 'unknown'),
-                        page=meta.get('chunk_index', 0) + 1,
-                        chunk=doc[:150] + ('...' if len(doc) > 150 else '')
-                    ))
-    except Exception as e:
-        logger.warning(f"ChromaDB search error: {e}")
+        async for event, name, at in events:
+            if event == "start":
+                started_at[name] = at
+                if name in start_messages:
+                    yield "thought", thought(*start_messages[name], started=at)
+                continue
+            span = {"started": started_at[name], "ended": at}
+            CHAT_STAGE_SECONDS.observe(at - started_at[name], stage=name)
+            if event == "timeout":
+                if name in skip_messages:
+                    yield "thought", thought(*deadline.skipped(*skip_messages[name]), **span)
+            elif name == "weather":
+                weather_data = results["weather"]
+                if weather_data and weather_data.get("error"):
+                    yield "thought", thought("Location Not Found", "Could not identify a known location in the question", **span)
+                elif weather_data:
+                    yield "thought", thought("Weather Data Retrieved", f"Got data for {weather_data['location']}: {weather_data['summary']}", **span)
+                else:
+                    yield "thought", thought("Weather Unavailable", "Could not fetch the Open-Meteo forecast; answering without weather data", **span)
+            elif name == "cache" and results["cache"]:
+                cached = results["cache"]
+                yield "thought", thought("Answer Cache Hit", "Returning a stored answer to an equivalent question", **span)
+                conversation_store.append(request.session_id, request.message, cached['response'])
+                yield "token", cached['response']
+                yield "citations", cached['citations']
+                yield "memory", []
+                CHAT_REQUEST_SECONDS.observe(time.monotonic() - request_started)
+                return
+            elif name == "documents":
+                if results["documents"]:
+                    retrieved, retrieval_mode, (context_text, context_chunks) = results["documents"]
+                if context_chunks:
+                    yield "thought", thought(
+                        "Documents Found",
+                        f"Found {len(retrieved)} relevant chunks from uploaded documents ({retrieval_mode} retrieval); "
+                        f"{len(context_chunks)} fit the ~{estimate_tokens(context_text)}-token context",
+                        **span
+                    )
+                else:
+                    yield "thought", thought("No Documents", "No relevant documents found in knowledge base", **span)
+            elif name == "memory_recall" and results["memory_recall"]:
+                memories = results["memory_recall"]
+                yield "thought", thought("Memory Recall", f"Added {len(memories)} relevant memories to the prompt", **span)
+    finally:
+        await events.aclose()
 
     has_context = bool(context_chunks)
-    if has_context:
-        thoughts.append(ThoughtStep(step="Documents Found", detail=f"Found {len(context_chunks)} relevant chunks from uploaded documents"))
-    else:
-        thoughts.append(ThoughtStep(step="No Documents", detail="No relevant documents found in knowledge base"))
+    citations = [
+        Citation(
+            source=chunk['source'],
+            page=chunk['page'],
+            chunk=chunk['text'][:150] + ('...' if len(chunk['text']) > 150 else '')
+        )
+        for chunk in context_chunks
+    ]
 
-    context_text = "\n\n".join([f"[Source: {c['source']}, Chunk {c['chunk_index']+1}]\n{c['text']}" for c in context_chunks])
+    if history:
+        yield "thought", thought("Conversation Context", f"Including ~{estimate_tokens(history)} tokens of earlier turns from this session")
 
     # Step 3: LLM call
-    thoughts.append(ThoughtStep(step="Generating Response", detail="Calling Gemini AI with retrieved context..."))
-    system_msg = build_system_prompt(context_text, weather_data, has_context)
-
+    generation_started = time.monotonic()
+    yield "thought", thought("Generating Response", "Calling Gemini AI with retrieved context...", started=generation_started, ended=generation_started)
+    system_msg = build_system_prompt(context_text, weather_data, has_context, memories, history)
+
+    full_prompt = f"{system_msg}\n\nUser question: {request.message}"
+    response_parts = []
+    timed_out = False
+    stream = llm_gateway.stream(full_prompt)
     try:
-        full_prompt = f"{system_msg}\n\nUser question: {request.message}"
-        response_text = None
-        for attempt in range(3):
+        while True:
             try:
-                gemini_response = gemini_client.models.generate_content(
-                    model='gemini-2.5-flash',
-                    contents=full_prompt
-                )
-                response_text = gemini_response.text
+                token = await deadline.run(stream.__anext__(), reserved=False)
+            except StopAsyncIteration:
                 break
-            except Exception as retry_err:
-                if "429" in str(retry_err) and attempt < 2:
-                    logger.info(f"Rate limited, retrying in {(attempt+1)*20}s...")
-                    await asyncio.sleep((attempt + 1) * 20)
-                else:
-                    raise retry_err
-        if response_text is None:
-            response_text = "I encountered an error generating a response. Please try again."
+            response_parts.append(token)
+            yield "token", token
+    except asyncio.TimeoutError:
+        timed_out = True
+        skipped = deadline.skipped("Generation", "the answer may be incomplete" if response_parts else "no answer was generated")
+        yield "thought", thought(*skipped, started=generation_started)
     except Exception as e:
         logger.error(f"LLM error: {e}")
-        response_text = "I encountered an error generating a response. Please try again."
+    finally:
+        await stream.aclose()
+        generation_ended = time.monotonic()
+        CHAT_STAGE_SECONDS.observe(generation_ended - generation_started, stage="generation")
+    llm_failed = not response_parts
+    span = {"started": generation_started, "ended": generation_ended}
+    if llm_failed and not timed_out:
+        yield "thought", thought("Generation Failed", "Gemini returned no answer", **span)
+    elif not timed_out:
+        yield "thought", thought("Response Generated", f"Streamed ~{estimate_tokens(''.join(response_parts))} tokens from Gemini", **span)
+    if llm_failed:
+        if timed_out:
+            error_text = "This request ran out of time before an answer was ready. Please try again."
+        else:
+            error_text = "I encountered an error generating a response. Please try again."
+        response_parts.append(error_text)
+        yield "token", error_text
+    response_text = "".join(response_parts)
 
     if not has_context and not is_weather:
         citations = []
+    yield "citations", citations[:5]
+    if not llm_failed and not timed_out:
+        conversation_store.append(request.session_id, request.message, response_text)
+    if cacheable and not llm_failed and not timed_out:
+        answer_cache.put(request.message, results.get("embedding"), cache_version, response_text, citations[:5])
+
+    # Step 4: Memory decision (runs in the background memory worker)
+    if not route.memory:
+        yield "thought", thought("Memory Skipped", "Routing found nothing worth remembering in this question")
+    elif timed_out:
+        yield "thought", thought("Memory Skipped", "The answer was cut short by the request deadline")
+    elif memory_worker.submit(request.message, response_text):
+        yield "thought", thought("Memory Queued", "Conversation queued for background memory extraction")
+    else:
+        yield "thought", thought("Memory Skipped", "Memory worker is not running")
+    CHAT_REQUEST_SECONDS.observe(time.monotonic() - request_started)
+    yield "memory", []
+
 
-    # Step 4: Memory decision
+def format_sse(event: str, payload: Any) -> str:
+    if isinstance(payload, BaseModel):
+        data = payload.model_dump()
+    elif isinstance(payload, list):
+        data = [p.model_dump() if isinstance(p, BaseModel) else p for p in payload]
+    else:
+        data = payload
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@api_router.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest):
+    thoughts = []
+    response_parts = []
+    citations = []
     memory_updates = []
-    thoughts.append(ThoughtStep(step="Updating Memory", detail="Analyzing conversation for high-signal facts..."))
-    try:
-        memory_updates = await decide_memory(request.message, response_text)
-        if memory_updates:
-            for entry in memory_updates:
-                await write_memory(entry)
-            thoughts.append(ThoughtStep(step="Memory Written", detail=f"Extracted {len(memory_updates)} fact(s) to memory"))
-        else:
-            thoughts.append(ThoughtStep(step="No Memory Update", detail="No high-signal facts detected in this exchange"))
-    except Exception as e:
-        logger.warning(f"Memory error: {e}")
-        thoughts.append(ThoughtStep(step="Memory Skipped", detail="Memory analysis skipped due to rate limits"))
+    async for event, payload in chat_events(request):
+        if event == "thought":
+            thoughts.append(payload)
+        elif event == "token":
+            response_parts.append(payload)
+        elif event == "citations":
+            citations = payload
+        elif event == "memory":
+            memory_updates = payload
 
     return ChatResponse(
-        response=response_text,
-        citations=citations[:5],
+        response="".join(response_parts),
+        citations=citations,
         thoughts=thoughts,
         memory_updates=memory_updates
     )
 
 
+@api_router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Server-Sent Events variant of /chat: thoughts and tokens are flushed as they happen"""
+    async def event_source():
+        async for event, payload in chat_events(request):
+            yield format_sse(event, payload)
+        yield format_sse("done", {})
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @api_router.get("/memory/{memory_type}")
-async def get_memory(memory_type: str):
+async def get_memory(memory_type: str, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=500)):
     if memory_type not in ("user", "company"):
         raise HTTPException(400, "memory_type must be 'user' or 'company'")
-    path = USER_MEMORY_PATH if memory_type == "user" else COMPANY_MEMORY_PATH
-    content = path.read_text() if path.exists() else ""
-    return {"type": memory_type, "content": content}
+    entries = await asyncio.to_thread(memory_store.page, memory_type, offset, limit)
+    total = await asyncio.to_thread(memory_store.count, memory_type)
+    header = f"# {'User' if memory_type == 'user' else 'Company'} Memory\n\n"
+    lines = [f"- [{e['timestamp'][:16].replace('T', ' ')}] {e['fact']}" for e in entries]
+    return {
+        "type": memory_type,
+        "content": header + "\n".join(lines),
+        "entries": entries,
+        "offset": offset,
+        "limit": limit,
+        "total": total
+    }
 
 
 @api_router.get("/memory-feed")
-async def get_memory_feed():
-    return sorted(MEMORY_FEED, key=lambda entry: entry["timestamp"], reverse=True)[:50]
+async def get_memory_feed(
+    since: int = Query(0, ge=0),
+    before: Optional[int] = Query(None, ge=1),
+    limit: int = Query(50, ge=1, le=200)
+):
+    """Newest-first feed; pass the highest seq seen as ``since`` to poll for new entries only"""
+    return MEMORY_FEED.page(since, before, limit)
 
 
 @api_router.delete("/reset")
@@ -436,7 +2713,11 @@ async def reset_all():
     except Exception as e:
         logger.warning(f"ChromaDB reset error: {e}")
 
-    DOCUMENTS_STORE.clear()
+    bm25_index.clear()
+    document_registry.clear()
+    answer_cache.invalidate()
+    await asyncio.to_thread(memory_store.clear)
+    conversation_store.clear()
     MEMORY_FEED.clear()
 
     # Reset memory files
@@ -452,11 +2733,7 @@ async def sanity_check():
     artifacts_dir.mkdir(exist_ok=True)
     test_query = "What is this system about?"
     try:
-        result = gemini_client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=test_query
-        )
-        response = result.text
+        response = await llm_gateway.generate(test_query)
     except Exception:
         response = "Sanity check - LLM unavailable"
 
@@ -465,7 +2742,7 @@ async def sanity_check():
         "sample_query": test_query,
         "agent_response": response,
         "citations": [],
-        "documents_indexed": len(DOCUMENTS_STORE),
+        "documents_indexed": len(document_registry),
         "status": "ok"
     }
     with open(artifacts_dir / "sanity_output.json", "w") as f:
@@ -473,4 +2750,33 @@ async def sanity_check():
     return output
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of latency histograms and counters"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# --- Lifecycle ---
+@app.on_event("startup")
+async def startup():
+    global STORAGE_LOAD_SECONDS
+    memory_worker.start()
+    embedding_service.start()
+    await weather_client.start()
+    await asyncio.to_thread(get_gazetteer)
+    if STORAGE_MODE == "persistent":
+        started = time.perf_counter()
+        await asyncio.to_thread(rebuild_lexical_index)
+        STORAGE_LOAD_SECONDS = round(STORAGE_LOAD_SECONDS + time.perf_counter() - started, 3)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await memory_worker.stop()
+    await embedding_service.stop()
+    await weather_client.stop()
+    if _ingest_pool is not None:
+        _ingest_pool.shutdown(cancel_futures=True)
+
+
 app.include_router(api_router)
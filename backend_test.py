@@ -252,14 +252,14 @@ class AgenticRAGTester:
             response = self.session.get(f"{self.base_url}/documents", timeout=30)
             success = response.status_code == 200
             
-            data = response.json() if success else []
+            data = response.json() if success else {}
             details = f"Status: {response.status_code}"
             if success:
-                doc_count = len(data) if isinstance(data, list) else 0
-                details += f", Documents: {doc_count}"
+                documents = data.get('documents', []) if isinstance(data, dict) else []
+                details += f", Documents: {data.get('total', len(documents))}"
                 
-                if data and isinstance(data, list):
-                    sample_doc = next((d for d in data if 'sample_technical_doc' in d.get('filename', '')), None)
+                if documents:
+                    sample_doc = next((d for d in documents if 'sample_technical_doc' in d.get('filename', '')), None)
                     if sample_doc:
                         details += f", Sample Doc Found: ✓ ({sample_doc.get('chunks', 0)} chunks)"
             
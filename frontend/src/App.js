@@ -1,4 +1,4 @@
-import { useState, useCallback, useRef } from "react";
+import { useState, useCallback, useRef, useEffect } from "react";
 import "@/App.css";
 import axios from "axios";
 import { toast } from "sonner";
@@ -14,6 +14,7 @@ const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
 function App() {
   const [documents, setDocuments] = useState([]);
+  const [documentTotal, setDocumentTotal] = useState(0);
   const [memoryEntries, setMemoryEntries] = useState([]);
   const [sessionId, setSessionId] = useState(() => crypto.randomUUID());
   const [resetting, setResetting] = useState(false);
@@ -21,12 +22,37 @@ function App() {
 
   const handleDocumentUploaded = useCallback((doc) => {
     setDocuments((prev) => [...prev, doc]);
+    setDocumentTotal((prev) => prev + 1);
   }, []);
 
   const handleDocumentDeleted = useCallback((docId) => {
     setDocuments((prev) => prev.filter((d) => d.id !== docId));
+    setDocumentTotal((prev) => Math.max(0, prev - 1));
   }, []);
 
+  // Memory is extracted in the background after each chat, so poll the feed
+  // and only ask for entries newer than the last seq seen.
+  useEffect(() => {
+    let cursor = 0;
+    const fetchFeed = async () => {
+      try {
+        const res = await axios.get(`${API}/memory-feed`, {
+          params: { since: cursor, limit: 50 },
+        });
+        if (res.data.length > 0) {
+          cursor = res.data[0].seq;
+          setMemoryEntries((prev) => [...res.data, ...prev].slice(0, 50));
+        }
+      } catch (e) {
+        console.error("Failed to fetch memory feed", e);
+      }
+    };
+    setMemoryEntries([]);
+    fetchFeed();
+    const interval = setInterval(fetchFeed, 5000);
+    return () => clearInterval(interval);
+  }, [sessionId]);
+
   const handleMemoryUpdate = useCallback((entries) => {
     if (entries && entries.length > 0) {
       setMemoryEntries((prev) => [...entries, ...prev]);
@@ -39,6 +65,7 @@ function App() {
     try {
       await axios.delete(`${API}/reset`);
       setDocuments([]);
+      setDocumentTotal(0);
       setMemoryEntries([]);
       setSessionId(crypto.randomUUID());
       if (chatResetRef.current) chatResetRef.current();
@@ -100,7 +127,7 @@ function App() {
               <div className="flex items-center gap-1.5 px-3 py-1.5 rounded-full bg-slate-100 border border-slate-200">
                 <Layers className="w-3.5 h-3.5 text-slate-500" strokeWidth={1.5} />
                 <span className="text-xs font-medium text-slate-600">
-                  {documents.length} docs
+                  {Math.max(documentTotal, documents.length)} docs
                 </span>
               </div>
               <div className="flex items-center gap-1.5 px-3 py-1.5 rounded-full bg-indigo-50 border border-indigo-200">
@@ -123,6 +150,8 @@ function App() {
             <KnowledgePanel
               documents={documents}
               setDocuments={setDocuments}
+              documentTotal={documentTotal}
+              setDocumentTotal={setDocumentTotal}
               onDocumentUploaded={handleDocumentUploaded}
               onDocumentDeleted={handleDocumentDeleted}
             />
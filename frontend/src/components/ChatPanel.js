@@ -262,7 +262,7 @@ export default function ChatPanel({ sessionId, onMemoryUpdate, onResetRef }) {
                                   className="inline-flex items-center gap-1 px-2 py-1 text-[11px] font-medium text-blue-600 bg-blue-50 rounded-full border border-blue-200 hover:bg-blue-100 transition-colors duration-200 cursor-pointer"
                                 >
                                   <FileSearch className="w-3 h-3" strokeWidth={1.5} />
-                                  {c.source}: Page {c.page}
+                                  {c.source}{c.page != null && `: Page ${c.page}`}
                                 </button>
                               </TooltipTrigger>
                               <TooltipContent
@@ -1,4 +1,4 @@
-import { useState, useCallback, useEffect } from "react";
+import { useState, useCallback, useEffect, useRef } from "react";
 import axios from "axios";
 import { toast } from "sonner";
 import { ScrollArea } from "@/components/ui/scroll-area";
@@ -22,10 +22,14 @@ import {
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
 const STEPS = ["Parsing", "Chunking", "Indexing"];
+const PAGE_SIZE = 100;
+const MAX_PAGE_SIZE = 1000;
 
 export default function KnowledgePanel({
   documents = [],
   setDocuments,
+  documentTotal = 0,
+  setDocumentTotal,
   onDocumentUploaded,
   onDocumentDeleted,
 }) {
@@ -33,26 +37,49 @@ export default function KnowledgePanel({
   const [uploading, setUploading] = useState(false);
   const [uploadStep, setUploadStep] = useState(-1);
   const [uploadProgress, setUploadProgress] = useState(0);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const loadedCount = useRef(0);
 
   const documentList = Array.isArray(documents)
     ? documents
     : Array.isArray(documents?.documents)
     ? documents.documents
     : [];
+  loadedCount.current = documentList.length;
+  const total = Math.max(documentTotal, documentList.length);
 
   useEffect(() => {
     fetchDocuments();
   }, []);
 
+  // Reload from the start, keeping as many documents as are already shown
   const fetchDocuments = async () => {
     try {
-      const res = await axios.get(`${API}/documents`);
-      setDocuments(res.data);
+      const limit = Math.min(MAX_PAGE_SIZE, Math.max(PAGE_SIZE, loadedCount.current));
+      const res = await axios.get(`${API}/documents`, { params: { offset: 0, limit } });
+      setDocuments(res.data.documents);
+      setDocumentTotal(res.data.total);
     } catch (e) {
       console.error("Failed to fetch documents", e);
     }
   };
 
+  const loadMoreDocuments = async () => {
+    setLoadingMore(true);
+    try {
+      const res = await axios.get(`${API}/documents`, {
+        params: { offset: documentList.length, limit: PAGE_SIZE },
+      });
+      const seen = new Set(documentList.map((d) => d.id));
+      setDocuments([...documentList, ...res.data.documents.filter((d) => !seen.has(d.id))]);
+      setDocumentTotal(res.data.total);
+    } catch (e) {
+      toast.error("Failed to load more documents");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleUpload = useCallback(
     async (files) => {
       for (const file of files) {
@@ -86,8 +113,12 @@ export default function KnowledgePanel({
           setUploadProgress(100);
           await new Promise((r) => setTimeout(r, 200));
 
-          onDocumentUploaded(res.data);
-          toast.success(`Indexed ${file.name} (${res.data.chunks} chunks)`);
+          if (res.data.status === "duplicate") {
+            toast.info(`${file.name} is already indexed`);
+          } else {
+            onDocumentUploaded(res.data);
+            toast.success(`Indexed ${file.name} (${res.data.chunks} chunks)`);
+          }
           fetchDocuments();
         } catch (e) {
           toast.error(
@@ -239,7 +270,7 @@ export default function KnowledgePanel({
       <div className="flex-1 overflow-hidden mt-3">
         <div className="px-4 pb-1">
           <p className="text-xs font-semibold text-slate-500 uppercase tracking-wider">
-            Indexed Documents ({documentList.length})
+            Indexed Documents ({total})
           </p>
         </div>
         <ScrollArea className="h-[calc(100%-1.5rem)] px-4">
@@ -284,6 +315,17 @@ export default function KnowledgePanel({
                   </Tooltip>
                 </div>
               ))}
+              {documentList.length < total && (
+                <button
+                  data-testid="load-more-documents"
+                  onClick={loadMoreDocuments}
+                  disabled={loadingMore}
+                  className="w-full flex items-center justify-center gap-1.5 py-2 text-xs font-medium text-blue-600 rounded-lg border border-dashed border-blue-200 hover:bg-blue-50 transition-colors duration-200 disabled:opacity-60"
+                >
+                  {loadingMore && <Loader2 className="w-3 h-3 animate-spin" />}
+                  Showing {documentList.length} of {total} · Load more
+                </button>
+              )}
             </div>
           )}
         </ScrollArea>
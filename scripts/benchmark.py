@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+benchmark.py - Offline load test for the backend API
+
+Starts the FastAPI app in-process on a local port with fake Gemini, fake
+Open-Meteo and a hash embedder, so no network or API key is needed. It
+uploads a synthetic corpus, then measures /api/upload, /api/documents and
+/api/chat at each concurrency level and reports p50/p95/p99 latency and
+requests/sec. Chat answers that come back with status 200 but no real
+answer (deadline or LLM failure) count as errors, and answers missing a
+stage count as degraded. The gateway's rate limits are off unless
+--llm-rpm/--llm-tpm are given. Results are written as JSON; pass
+--baseline with an earlier results file to print the change per endpoint
+and concurrency level.
+
+Usage:
+    python scripts/benchmark.py
+    python scripts/benchmark.py --concurrency 1,8,32 --chat-requests 200 --llm-latency 0.5
+    python scripts/benchmark.py --llm-429-rate 0.05 --output after.json --baseline before.json
+    python scripts/benchmark.py --llm-rpm 60 --llm-tpm 250000   # measure under a Gemini tier's quota
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import types
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import List, Tuple
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+WORDS = (
+    "account api billing cache cluster config customer dashboard database deploy error event export "
+    "feature gateway incident invoice job latency limit log metric migration node order pipeline plan "
+    "queue region release report request retry role schema service session storage subscription sync "
+    "team tenant timeout token upload user webhook worker workflow the a of to and in for with on is "
+    "when after before during each every must should can will not only also then because while"
+).split()
+CITIES = ["London", "Paris", "Tokyo", "Berlin", "Madrid", "Toronto", "Sydney", "Mumbai", "Cairo", "Lima"]
+SMALL_TALK = ["hi", "hello there", "thanks!", "good morning"]
+
+
+# --- Fakes ---
+class RateLimitError(Exception):
+    code = 429
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeModels:
+    """Stands in for client.aio.models with fixed latency and a random 429 rate"""
+
+    def __init__(self, latency: float, rate_limit_rate: float, stream_chunks: int = 20):
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.stream_chunks = stream_chunks
+        self.calls = 0
+
+    def _maybe_rate_limit(self):
+        self.calls += 1
+        if random.random() < self.rate_limit_rate:
+            raise RateLimitError("429 RESOURCE_EXHAUSTED (fake)")
+
+    async def generate_content(self, model, contents, **kwargs):
+        self._maybe_rate_limit()
+        await asyncio.sleep(self.latency)
+        # Memory decisions expect a JSON list; nothing is worth remembering here
+        return FakeResponse("[]" if "high-signal facts" in str(contents) else "A short fake summary.")
+
+    async def generate_content_stream(self, model, contents, **kwargs):
+        self._maybe_rate_limit()
+
+        async def chunks():
+            for i in range(self.stream_chunks):
+                await asyncio.sleep(self.latency / self.stream_chunks)
+                yield FakeResponse(f"token{i} ")
+        return chunks()
+
+
+def fake_forecast_transport(latency: float) -> httpx.MockTransport:
+    hours = 72
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency)
+        return httpx.Response(200, json={"hourly": {
+            "time": [f"2026-01-{1 + i // 24:02d}T{i % 24:02d}:00" for i in range(hours)],
+            "temperature_2m": [10 + 5 * math.sin(i / 24 * 2 * math.pi) for i in range(hours)],
+            "relative_humidity_2m": [60 + (i % 12) for i in range(hours)],
+            "wind_speed_10m": [8 + (i % 7) for i in range(hours)],
+            "precipitation": [0.2 if i % 9 == 0 else 0.0 for i in range(hours)],
+        }})
+    return httpx.MockTransport(handler)
+
+
+def hash_embed(texts, dims: int = 256):
+    """Deterministic bag-of-words embedding; keeps Chroma and the caches realistic without a model download"""
+    vectors = []
+    for text in texts:
+        vector = [0.0] * dims
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest()[:8], 16) % dims] += 1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        vectors.append([v / norm for v in vector])
+    return vectors
+
+
+# --- Synthetic data ---
+def make_document(rng: random.Random, index: int, words: int) -> str:
+    sentences = []
+    count = 0
+    while count < words:
+        length = rng.randint(8, 20)
+        sentence = [rng.choice(WORDS) for _ in range(length)]
+        if rng.random() < 0.2:
+            sentence.insert(rng.randrange(length), f"ERR-{index}{rng.randint(100, 999)}")
+        sentences.append(" ".join(sentence).capitalize() + ".")
+        count += length
+        if rng.random() < 0.15:
+            sentences.append("\n\n")
+    return f"# Synthetic document {index}\n\n" + " ".join(sentences)
+
+
+def make_question(rng: random.Random, doc_count: int, weather_ratio: float) -> str:
+    roll = rng.random()
+    if roll < weather_ratio:
+        return f"What's the weather in {rng.choice(CITIES)} this week?"
+    if roll < weather_ratio + 0.05:
+        return rng.choice(SMALL_TALK)
+    if roll < weather_ratio + 0.35:
+        return f"According to the docs, what does ERR-{rng.randrange(max(doc_count, 1))}{rng.randint(100, 999)} mean?"
+    topic = " ".join(rng.sample(WORDS[:45], 3))
+    return f"Explain how the {topic} works in our documentation"
+
+
+# --- Load generation ---
+def percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+# Chat answers with a 200 status that carry no real answer
+CHAT_FAILURE_TEXTS = ("ran out of time before an answer", "I encountered an error generating")
+
+
+def http_outcome(response: httpx.Response) -> str:
+    return "error" if response.status_code >= 400 else "ok"
+
+
+def chat_outcome(response: httpx.Response) -> str:
+    """Failed or fallback answers are errors; answers missing a stage (deadline, no weather) are degraded"""
+    if response.status_code >= 400:
+        return "error"
+    body = response.json()
+    if any(text in body.get("response", "") for text in CHAT_FAILURE_TEXTS):
+        return "error"
+    for thought in body.get("thoughts", []):
+        if thought["step"] == "Weather Unavailable" or thought["detail"].startswith("Request deadline of"):
+            return "degraded"
+    return "ok"
+
+
+async def run_level(endpoint: str, make_request, total: int, concurrency: int, outcome=http_outcome) -> dict:
+    latencies = []
+    outcomes = Counter()
+    counter = itertools.count()
+
+    async def worker():
+        while (i := next(counter)) < total:
+            started = time.perf_counter()
+            try:
+                response = await make_request(i)
+                result = outcome(response)
+            except Exception:
+                result = "error"
+            latencies.append(time.perf_counter() - started)
+            outcomes[result] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    ms = [v * 1000 for v in latencies]
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": outcomes["error"],
+        "degraded": outcomes["degraded"],
+        "seconds": round(wall, 3),
+        "requests_per_second": round(total / wall, 2) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(ms, 50), 2),
+            "p95": round(percentile(ms, 95), 2),
+            "p99": round(percentile(ms, 99), 2),
+            "mean": round(sum(ms) / len(ms), 2) if ms else 0.0,
+            "max": round(ms[-1], 2) if ms else 0.0,
+        },
+    }
+
+
+def print_row(row: dict):
+    lat = row["latency_ms"]
+    print(f"  {row['endpoint']:<16} c={row['concurrency']:<4} n={row['requests']:<5} err={row['errors']:<4} deg={row['degraded']:<4} "
+          f"rps={row['requests_per_second']:>8.2f}  p50={lat['p50']:>8.1f}ms  p95={lat['p95']:>8.1f}ms  p99={lat['p99']:>8.1f}ms")
+
+
+def compare(results: list, baseline_path: str):
+    baseline = json.loads(Path(baseline_path).read_text())
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nChange vs {baseline_path} (negative p95 and positive rps are improvements):")
+    for row in results:
+        old = previous.get((row["endpoint"], row["concurrency"]))
+        if not old:
+            continue
+        p95 = (row["latency_ms"]["p95"] - old["latency_ms"]["p95"]) / (old["latency_ms"]["p95"] or 1) * 100
+        rps = (row["requests_per_second"] - old["requests_per_second"]) / (old["requests_per_second"] or 1) * 100
+        print(f"  {row['endpoint']:<16} c={row['concurrency']:<4} p95 {p95:+7.1f}%   rps {rps:+7.1f}%")
+
+
+# --- App under test ---
+def load_server(args, workdir: Path):
+    os.environ.update({
+        "GEMINI_API_KEY": "benchmark",
+        "STORAGE_MODE": "memory",
+        "DATA_DIR": str(workdir / "data"),
+        "MEMORY_DB_PATH": str(workdir / "memory.db"),
+        "ANONYMIZED_TELEMETRY": "False",
+        # The gateway's rate limits would otherwise be what gets measured
+        "LLM_RPM": str(args.llm_rpm),
+        "LLM_TPM": str(args.llm_tpm),
+    })
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    fake = types.SimpleNamespace(aio=types.SimpleNamespace(models=FakeModels(args.llm_latency, args.llm_429_rate)))
+    server.gemini_client = fake
+    server.llm_gateway.client = fake
+    server.embedding_service.embed_fn = hash_embed
+    server.weather_client._client = httpx.AsyncClient(transport=fake_forecast_transport(args.weather_latency))
+    # Keep memory exports out of the repository
+    server.USER_MEMORY_PATH = workdir / "USER_MEMORY.md"
+    server.COMPANY_MEMORY_PATH = workdir / "COMPANY_MEMORY.md"
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("server").setLevel(logging.WARNING)
+    return server
+
+
+def start_uvicorn(app):
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    uv_server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=uv_server.run, daemon=True)
+    thread.start()
+    while not uv_server.started:
+        if not thread.is_alive():
+            raise RuntimeError("Server failed to start")
+        time.sleep(0.05)
+    return uv_server, thread, f"http://127.0.0.1:{port}"
+
+
+async def run_benchmark(args, base_url: str) -> Tuple[List[dict], dict]:
+    rng = random.Random(args.seed)
+    levels = [int(c) for c in args.concurrency.split(",")]
+    results = []
+    limits = httpx.Limits(max_connections=max(levels) * 2, max_keepalive_connections=max(levels) * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        doc_index = itertools.count()
+
+        async def upload(_):
+            index = next(doc_index)
+            body = make_document(rng, index, args.doc_words).encode()
+            return await client.post("/api/upload", files={"file": (f"doc{index}.md", body, "text/markdown")})
+
+        print("Uploading corpus...")
+        for _ in range(max(0, args.corpus_docs)):
+            await upload(None)
+
+        print("Benchmarking:")
+        for concurrency in levels:
+            row = await run_level("/api/upload", upload, args.upload_requests, concurrency)
+            results.append(row)
+            print_row(row)
+
+        async def list_documents(i):
+            return await client.get("/api/documents", params={"offset": (i * 10) % 100, "limit": 100})
+
+        for concurrency in levels:
+            row = await run_level("/api/documents", list_documents, args.list_requests, concurrency)
+            results.append(row)
+            print_row(row)
+
+        doc_count = next(doc_index)
+
+        async def chat(_):
+            message = make_question(rng, doc_count, args.weather_ratio)
+            return await client.post("/api/chat", json={"message": message, "session_id": str(uuid.uuid4())})
+
+        for concurrency in levels:
+            row = await run_level("/api/chat", chat, args.chat_requests, concurrency, outcome=chat_outcome)
+            results.append(row)
+            print_row(row)
+
+        health = (await client.get("/api/health")).json()
+    return results, health
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test with fake Gemini and Open-Meteo backends")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--corpus-docs", type=int, default=50, help="Documents uploaded before measuring")
+    parser.add_argument("--doc-words", type=int, default=2000, help="Words per synthetic document")
+    parser.add_argument("--upload-requests", type=int, default=20, help="Uploads per concurrency level")
+    parser.add_argument("--list-requests", type=int, default=200, help="Document list calls per concurrency level")
+    parser.add_argument("--chat-requests", type=int, default=50, help="Chat calls per concurrency level")
+    parser.add_argument("--weather-ratio", type=float, default=0.2, help="Share of chat questions about weather")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Fake Gemini latency in seconds")
+    parser.add_argument("--llm-429-rate", type=float, default=0.0, help="Probability a fake Gemini call returns 429")
+    parser.add_argument("--llm-rpm", type=float, default=0, help="Gateway requests-per-minute limit (LLM_RPM); 0 disables it")
+    parser.add_argument("--llm-tpm", type=float, default=0, help="Gateway tokens-per-minute limit (LLM_TPM); 0 disables it")
+    parser.add_argument("--weather-latency", type=float, default=0.1, help="Fake Open-Meteo latency in seconds")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Client timeout per request in seconds")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="rag-benchmark-") as tmp:
+        server = load_server(args, Path(tmp))
+        uv_server, thread, base_url = start_uvicorn(server.app)
+        try:
+            results, health = asyncio.run(run_benchmark(args, base_url))
+        finally:
+            uv_server.should_exit = True
+            thread.join(timeout=10)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+        "server": {
+            "answer_cache": health.get("answer_cache"),
+            "llm": health.get("llm"),
+            "documents_indexed": health.get("documents_indexed"),
+        },
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"\nResults written to {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# server.py reads its configuration at import time; keep tests offline and off the real memory store
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("STORAGE_MODE", "memory")
+os.environ.setdefault("MEMORY_DB_PATH", str(Path(tempfile.mkdtemp()) / "memory.db"))
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
@@ -0,0 +1,34 @@
+from datetime import datetime, timezone
+
+from server import analyze_forecast, current_hour_index
+
+TIMES = [f"2026-03-{1 + i // 24:02d}T{i % 24:02d}:00" for i in range(72)]
+# Temperature equals the hour index, so a window's min/max show where it starts
+HOURLY = {
+    "time": TIMES,
+    "temperature_2m": [float(i) for i in range(72)],
+    "relative_humidity_2m": [50.0] * 72,
+    "wind_speed_10m": [5.0] * 72,
+    "precipitation": [0.0] * 72,
+}
+
+
+def test_next_24h_starts_at_the_current_local_hour():
+    # 18:30 UTC is 20:30 at UTC+2, i.e. hour index 20 of the series
+    now = datetime(2026, 3, 1, 18, 30, tzinfo=timezone.utc)
+    result = analyze_forecast("Athens", HOURLY, utc_offset_seconds=7200, now=now)
+    assert result["next_24h_from"] == "2026-03-01T20:00"
+    assert result["min_temperature"] == 20.0
+    assert result["max_temperature"] == 43.0
+    assert "Range 20.0-43.0 C (next 24h)" in result["summary"]
+    # Daily figures stay aligned to calendar days
+    assert result["daily"][0]["date"] == "2026-03-01"
+    assert result["daily"][0]["temp_min"] == 0.0
+
+
+def test_series_outside_the_current_time_starts_at_the_first_hour():
+    now = datetime(2030, 1, 1, tzinfo=timezone.utc)
+    assert current_hour_index(TIMES, now=now) == 0
+    assert current_hour_index([], now=now) == 0
+    result = analyze_forecast("Athens", HOURLY, now=now)
+    assert result["min_temperature"] == 0.0
@@ -0,0 +1,40 @@
+import asyncio
+
+import server
+from server import ConversationStore
+
+
+class HeldGateway:
+    """Stands in for llm_gateway; summary calls wait until released"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.prompts = []
+
+    async def generate(self, prompt: str, priority: int = 0) -> str:
+        self.prompts.append(prompt)
+        await self.release.wait()
+        return "turns 0 and 1 were about billing"
+
+
+def test_turns_stay_in_history_until_summarized(monkeypatch):
+    async def main():
+        gateway = HeldGateway()
+        monkeypatch.setattr(server, "llm_gateway", gateway)
+        store = ConversationStore(max_sessions=10, ttl=3600, history_tokens=40, summary_tokens=50)
+        for i in range(4):
+            store.append("s", f"question {i} " + "x" * 40, f"answer {i}")
+        await asyncio.sleep(0.01)
+        while_summarizing = store.render("s")
+        gateway.release.set()
+        await asyncio.gather(*store._tasks)
+        return gateway, while_summarizing, store.render("s")
+
+    gateway, while_summarizing, after = asyncio.run(main())
+    assert len(gateway.prompts) == 1
+    assert all(f"question {i}" in while_summarizing for i in range(4))
+    assert "Summary of earlier conversation: turns 0 and 1 were about billing" in after
+    rolled = [i for i in range(4) if f"question {i}" in gateway.prompts[0]]
+    assert rolled
+    assert all(f"question {i}" not in after for i in rolled)
+    assert all(f"question {i}" in after for i in range(4) if i not in rolled)
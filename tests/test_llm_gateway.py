@@ -0,0 +1,162 @@
+import asyncio
+import time
+import types
+
+import pytest
+
+import server
+from server import LLMGateway, LLM_PRIORITY_BACKGROUND, LLM_PRIORITY_INTERACTIVE
+
+
+class RateLimitError(Exception):
+    code = 429
+
+
+class FakeModels:
+    """Stands in for client.aio.models: records calls, can answer 429 once per prompt or hold a call open"""
+
+    def __init__(self, latency: float = 0.01, rate_limited=(), held=()):
+        self.latency = latency
+        self.rate_limited = set(rate_limited)
+        self.held = {prompt: asyncio.Event() for prompt in held}
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+
+    async def generate_content(self, model, contents):
+        self.calls.append((contents, time.monotonic()))
+        if contents in self.rate_limited:
+            self.rate_limited.discard(contents)
+            raise RateLimitError("429 RESOURCE_EXHAUSTED")
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            if contents in self.held:
+                await self.held[contents].wait()
+            await asyncio.sleep(self.latency)
+        finally:
+            self.running -= 1
+        return types.SimpleNamespace(text=f"answer to {contents}")
+
+    def prompts(self):
+        return [prompt for prompt, _ in self.calls]
+
+
+async def always_rate_limited(model, contents):
+    raise RateLimitError("429 RESOURCE_EXHAUSTED")
+
+
+def make_gateway(models: FakeModels, **kwargs) -> LLMGateway:
+    client = types.SimpleNamespace(aio=types.SimpleNamespace(models=models))
+    return LLMGateway(client, "fake-model", **kwargs)
+
+
+def test_rate_limit_pauses_every_caller(monkeypatch):
+    monkeypatch.setattr(server.random, "uniform", lambda low, high: 1.0)
+
+    async def main():
+        models = FakeModels(rate_limited={"first"})
+        gateway = make_gateway(models, max_concurrency=1, backoff_base=0.2)
+        answers = await asyncio.gather(gateway.generate("first"), gateway.generate("second"))
+        return models, gateway, answers
+
+    models, gateway, answers = asyncio.run(main())
+    assert answers == ["answer to first", "answer to second"]
+    assert gateway.rate_limited == 1
+    # The 429'd request keeps its place in line, and nobody runs until the backoff ends
+    assert models.prompts() == ["first", "first", "second"]
+    limited_at = models.calls[0][1]
+    assert all(started - limited_at >= 0.19 for _, started in models.calls[1:])
+
+
+def test_rate_limit_gives_up_after_max_retries():
+    async def main():
+        models = FakeModels()
+        models.generate_content = always_rate_limited
+        gateway = make_gateway(models, max_concurrency=1, max_retries=2, backoff_base=0.01)
+        with pytest.raises(RateLimitError):
+            await gateway.generate("hopeless")
+        return gateway
+
+    gateway = asyncio.run(main())
+    assert gateway.rate_limited == 2
+    assert gateway.stats()["in_flight"] == 0
+
+
+def test_concurrency_cap():
+    async def main():
+        models = FakeModels(latency=0.05)
+        gateway = make_gateway(models, max_concurrency=2)
+        await asyncio.gather(*(gateway.generate(f"q{i}") for i in range(6)))
+        return models, gateway
+
+    models, gateway = asyncio.run(main())
+    assert len(models.calls) == 6
+    assert models.max_running == 2
+    assert gateway.stats()["in_flight"] == 0
+
+
+def test_interactive_runs_before_background():
+    async def main():
+        models = FakeModels(held={"blocker"})
+        gateway = make_gateway(models, max_concurrency=1)
+        blocker = asyncio.create_task(gateway.generate("blocker"))
+        await asyncio.sleep(0.01)
+        queued = [
+            asyncio.create_task(gateway.generate("background-1", priority=LLM_PRIORITY_BACKGROUND)),
+            asyncio.create_task(gateway.generate("background-2", priority=LLM_PRIORITY_BACKGROUND)),
+            asyncio.create_task(gateway.generate("interactive-1")),
+            asyncio.create_task(gateway.generate("interactive-2")),
+        ]
+        await asyncio.sleep(0.01)
+        stats = gateway.stats()
+        models.held["blocker"].set()
+        await asyncio.gather(blocker, *queued)
+        return models, stats
+
+    models, stats = asyncio.run(main())
+    assert stats["queued_interactive"] == 2
+    assert stats["queued_background"] == 2
+    assert models.prompts() == ["blocker", "interactive-1", "interactive-2", "background-1", "background-2"]
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        models = FakeModels(held={"blocker"})
+        gateway = make_gateway(models, max_concurrency=1)
+        blocker = asyncio.create_task(gateway.generate("blocker"))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(gateway.generate("abandoned"))
+        await asyncio.sleep(0.01)
+        assert gateway.stats()["queued_interactive"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert gateway.stats()["queued_interactive"] == 0
+        models.held["blocker"].set()
+        await blocker
+        # The freed slot goes to the next caller, not to the cancelled one
+        assert await gateway.generate("next") == "answer to next"
+        return models, gateway
+
+    models, gateway = asyncio.run(main())
+    assert "abandoned" not in models.prompts()
+    assert gateway.stats()["in_flight"] == 0
+    assert not gateway._queue
+
+
+def test_cancelled_after_admission_releases_the_slot():
+    async def main():
+        gateway = make_gateway(FakeModels(), max_concurrency=1)
+        await gateway._acquire(LLM_PRIORITY_INTERACTIVE, 10)
+        waiter = asyncio.create_task(gateway._acquire(LLM_PRIORITY_INTERACTIVE, 10))
+        await asyncio.sleep(0)
+        # Releasing admits the waiter at once; cancel it before it gets to run
+        gateway._release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return gateway
+
+    gateway = asyncio.run(main())
+    assert gateway.stats()["in_flight"] == 0
@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+import httpx
+
+import server
+from server import WeatherClient
+
+FORECAST = {"hourly": {"time": ["2026-01-01T00:00"], "temperature_2m": [4.2]}}
+
+
+class FakeOpenMeteo:
+    """MockTransport handler that counts upstream calls and answers after a delay"""
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls.append(dict(request.url.params))
+        await asyncio.sleep(self.delay)
+        return httpx.Response(200, json=FORECAST)
+
+
+def make_client(upstream: FakeOpenMeteo) -> WeatherClient:
+    client = WeatherClient("https://open-meteo.test/v1/forecast", timeout=5)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    return client
+
+
+def test_concurrent_requests_share_one_fetch():
+    async def main():
+        upstream = FakeOpenMeteo()
+        client = make_client(upstream)
+        results = await asyncio.gather(*(client.forecast(35.6895, 139.6917) for _ in range(5)))
+        await client.stop()
+        return upstream, client, results
+
+    upstream, client, results = asyncio.run(main())
+    assert len(upstream.calls) == 1
+    assert client.upstream_calls == 1
+    assert all(result == FORECAST for result in results)
+
+
+def test_different_locations_fetch_separately():
+    async def main():
+        upstream = FakeOpenMeteo()
+        client = make_client(upstream)
+        await asyncio.gather(client.forecast(35.6895, 139.6917), client.forecast(51.5074, -0.1278))
+        await client.stop()
+        return upstream
+
+    upstream = asyncio.run(main())
+    assert sorted(call["latitude"] for call in upstream.calls) == ["35.6895", "51.5074"]
+
+
+def test_cache_expires_at_the_next_hour(monkeypatch):
+    now = time.time()
+
+    async def main():
+        upstream = FakeOpenMeteo(delay=0)
+        client = make_client(upstream)
+        await client.forecast(48.8566, 2.3522)
+        await client.forecast(48.8566, 2.3522)
+        hits_before_expiry = client.cache_hits
+        monkeypatch.setattr(server.time, "time", lambda: now + 3600)
+        await client.forecast(48.8566, 2.3522)
+        await client.stop()
+        return upstream, client, hits_before_expiry
+
+    upstream, client, hits_before_expiry = asyncio.run(main())
+    assert hits_before_expiry == 1
+    assert client.cache_hits == 1
+    assert len(upstream.calls) == 2
+    expires, _ = client._cache[(48.8566, 2.3522)]
+    assert expires % 3600 == 0
+
+
+def test_cache_is_bounded():
+    async def main():
+        client = make_client(FakeOpenMeteo(delay=0))
+        client.max_entries = 2
+        for lat in (1.0, 2.0, 3.0):
+            await client.forecast(lat, 0.0)
+        await client.stop()
+        return client
+
+    client = asyncio.run(main())
+    assert list(client._cache) == [(2.0, 0.0), (3.0, 0.0)]
+
+
+def test_cancelled_caller_does_not_fail_the_others():
+    async def main():
+        upstream = FakeOpenMeteo(delay=0.2)
+        client = make_client(upstream)
+        first = asyncio.create_task(client.forecast(35.6895, 139.6917))
+        await asyncio.sleep(0.01)
+        others = [asyncio.create_task(client.forecast(35.6895, 139.6917)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        # The request that started the fetch runs out of time
+        first.cancel()
+        results = await asyncio.gather(*others)
+        # The fetch finished anyway and was cached for later requests
+        cached = await client.forecast(35.6895, 139.6917)
+        await client.stop()
+        return upstream, client, first, results, cached
+
+    upstream, client, first, results, cached = asyncio.run(main())
+    assert first.cancelled()
+    assert results == [FORECAST, FORECAST]
+    assert cached == FORECAST
+    assert len(upstream.calls) == 1
+    assert client.cache_hits == 1
+
+
+def test_failed_fetch_is_not_cached():
+    async def main():
+        async def unavailable(request):
+            return httpx.Response(503)
+
+        client = WeatherClient("https://open-meteo.test/v1/forecast", timeout=5)
+        client._client = httpx.AsyncClient(transport=httpx.MockTransport(unavailable))
+        outcomes = await asyncio.gather(*(client.forecast(1.0, 2.0) for _ in range(3)), return_exceptions=True)
+        await client.stop()
+        return client, outcomes
+
+    client, outcomes = asyncio.run(main())
+    assert all(isinstance(outcome, httpx.HTTPStatusError) for outcome in outcomes)
+    assert client.upstream_calls == 1
+    assert not client._cache
+    assert not client._inflight